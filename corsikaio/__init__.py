@@ -1,5 +1,12 @@
 from .file import CorsikaFile, CorsikaCherenkovFile, CorsikaParticleFile
-from .longitudinal import read_longitudinal_distributions, longitudinal_fit_function
+from .longitudinal import (
+    LongitudinalFile,
+    evaluate_longitudinal_fit,
+    fit_longitudinal,
+    longitudinal_fit_function,
+    read_longitudinal_distributions,
+)
+from .parallel import CorsikaDataset
 from .version import __version__
 
 
@@ -7,8 +14,12 @@ __all__ = [
     'CorsikaFile',
     'CorsikaCherenkovFile',
     'CorsikaParticleFile',
+    'CorsikaDataset',
+    'LongitudinalFile',
     'read_longitudinal_distributions',
     'longitudinal_fit_function',
+    'evaluate_longitudinal_fit',
+    'fit_longitudinal',
     'as_dict',
     '__version__',
 ]
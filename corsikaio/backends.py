@@ -0,0 +1,343 @@
+"""
+Registry of decompression backends.
+
+For each compression format, the backends are ordered by preference, the first one
+that is installed is used unless another one is chosen using `set_backend`.
+Faster drop-in replacements for the standard library are used automatically
+if installed, e.g. ``isal`` or ``zlib-ng`` for gzip.
+
+Run ``python -m corsikaio.backends <files>`` to compare the decompression speed
+of the available backends, see `benchmark`.
+"""
+import bz2
+import gzip
+import importlib.util
+import io
+import lzma
+import sys
+import time
+from collections import namedtuple
+
+
+__all__ = [
+    'available_backends',
+    'benchmark',
+    'detect_compression',
+    'get_backend',
+    'get_decompressor',
+    'open_decompressed',
+    'register_backend',
+    'register_compression',
+    'set_backend',
+]
+
+
+#: A way to decompress a format, ``open`` takes a path or binary file object
+#: and returns a readable binary stream, ``module`` is needed for it to be available.
+#: ``decompressor`` optionally creates an incremental decompressor for a single
+#: zstd frame, used for random access, see `get_decompressor`.
+Backend = namedtuple('Backend', ['name', 'module', 'open', 'decompressor'], defaults=(None, ))
+
+#: Decompression speed of a backend in MB of decompressed data per second
+BenchmarkResult = namedtuple('BenchmarkResult', ['compression', 'backend', 'mb_per_s'])
+
+# compression -> magic bytes
+_magic = {}
+# compression -> function compressing bytes, used for benchmarks
+_compressors = {}
+# compression -> backends in order of preference
+_backends = {}
+# compression -> name of the backend chosen using set_backend
+_selected = {}
+
+
+def register_compression(compression, magic, compress=None):
+    '''
+    Register a compression format, detected by files starting with ``magic``.
+
+    ``compress`` is an optional function compressing bytes, used by `benchmark`.
+    '''
+    _magic[compression] = magic
+    _compressors[compression] = compress
+    _backends.setdefault(compression, [])
+
+
+def register_backend(compression, name, open, module=None, first=False, decompressor=None):
+    '''
+    Register a backend for ``compression``.
+
+    Parameters
+    ----------
+    compression: str
+        Name of the format, e.g. ``'gzip'``
+    name: str
+        Name of the backend
+    open: callable
+        Called with a path or a binary file object, returns a readable binary
+        stream of the decompressed data. File objects passed in must not be closed
+        when the stream is closed, paths opened by ``open`` have to be.
+    module: str or None
+        Module required by the backend, it is only available if that is installed.
+    first: bool
+        If True, prefer this backend over the already registered ones.
+    decompressor: callable or None
+        Called without arguments, returns an object with a ``decompress(data)`` method
+        and ``eof`` and ``unused_data`` attributes, decompressing a single frame.
+        Needed for random access, see `corsikaio.seekable.ZstdReader`.
+    '''
+    backends = _backends.setdefault(compression, [])
+    backends[:] = [backend for backend in backends if backend.name != name]
+    backend = Backend(name, module, open, decompressor)
+    if first:
+        backends.insert(0, backend)
+    else:
+        backends.append(backend)
+
+
+def _is_installed(module):
+    if module is None:
+        return True
+    try:
+        return importlib.util.find_spec(module) is not None
+    except ImportError:
+        # parent package is missing
+        return False
+
+
+def available_backends(compression):
+    '''Names of the installed backends for ``compression``, in order of preference'''
+    return [
+        backend.name for backend in _backends.get(compression, [])
+        if _is_installed(backend.module)
+    ]
+
+
+def set_backend(compression, name):
+    '''
+    Use the backend ``name`` for ``compression`` instead of choosing automatically.
+    Pass ``name=None`` to go back to the automatic choice.
+    '''
+    if name is None:
+        _selected.pop(compression, None)
+        return
+
+    if name not in available_backends(compression):
+        raise ValueError(
+            f'Backend {name!r} for {compression} is not available,'
+            f' available: {available_backends(compression)}'
+        )
+    _selected[compression] = name
+
+
+def get_backend(compression, name=None):
+    '''
+    The `Backend` to use for ``compression``.
+
+    This is the one called ``name`` if given, otherwise the one chosen
+    using `set_backend` or the first available one.
+    '''
+    if compression not in _backends:
+        raise ValueError(f'Unknown compression {compression!r}')
+
+    name = name or _selected.get(compression)
+    for backend in _backends[compression]:
+        if (name is None or backend.name == name) and _is_installed(backend.module):
+            return backend
+
+    if name is not None:
+        raise ValueError(f'Backend {name!r} for {compression} is not available')
+    raise ValueError(f'No backend installed for {compression}')
+
+
+def get_decompressor(compression):
+    '''
+    Create an incremental decompressor for ``compression``, see `register_backend`.
+
+    The backend from `get_backend` is used if it provides one,
+    otherwise the first available backend that does.
+    '''
+    backends = [get_backend(compression)] + [
+        backend for backend in _backends.get(compression, [])
+        if _is_installed(backend.module)
+    ]
+    for backend in backends:
+        if backend.decompressor is not None:
+            return backend.decompressor()
+
+    raise ValueError(f'No backend installed that supports random access to {compression} files')
+
+
+def detect_compression(head):
+    '''Compression of a file from its first bytes, e.g. ``'gzip'``, or None if uncompressed'''
+    for compression, magic in _magic.items():
+        if head[:len(magic)] == magic:
+            return compression
+    return None
+
+
+def open_decompressed(source, compression, backend=None):
+    '''
+    Open the path or binary file object ``source`` compressed with ``compression``
+    for reading, using the given or the automatically chosen backend.
+    '''
+    return get_backend(compression, backend).open(source)
+
+
+def _open_zstandard(source):
+    from zstandard import ZstdDecompressor
+
+    if hasattr(source, 'read'):
+        f, closefd = source, False
+    else:
+        f, closefd = open(source, 'rb'), True
+    # files with multiple frames, e.g. in the seekable format, are read completely
+    return ZstdDecompressor().stream_reader(f, closefd=closefd, read_across_frames=True)
+
+
+def _zstandard_decompressor():
+    from zstandard import ZstdDecompressor
+    return ZstdDecompressor().decompressobj()
+
+
+def _stdlib_zstd_decompressor():
+    from compression import zstd
+    return zstd.ZstdDecompressor()
+
+
+def _compress_zstd(data, level=3):
+    '''Compress ``data`` to a single zstd frame with whichever library is installed'''
+    if _is_installed('zstandard'):
+        from zstandard import ZstdCompressor
+        return ZstdCompressor(level=level).compress(data)
+
+    from compression import zstd
+    return zstd.compress(data, level=level)
+
+
+def _compress_lz4(data):
+    import lz4.frame
+    return lz4.frame.compress(data)
+
+
+def _open_isal(source):
+    from isal import igzip
+    return igzip.open(source, 'rb')
+
+
+def _open_isal_threaded(source):
+    from isal import igzip_threaded
+    return igzip_threaded.open(source, 'rb', threads=1)
+
+
+def _open_zlib_ng(source):
+    from zlib_ng import gzip_ng
+    return gzip_ng.open(source, 'rb')
+
+
+def _open_zlib_ng_threaded(source):
+    from zlib_ng import gzip_ng_threaded
+    return gzip_ng_threaded.open(source, 'rb', threads=1)
+
+
+def _open_stdlib_zstd(source):
+    from compression import zstd
+    return zstd.open(source, 'rb')
+
+
+def _open_lz4(source):
+    import lz4.frame
+    return lz4.frame.open(source, 'rb')
+
+
+register_compression('gzip', b'\x1f\x8b', gzip.compress)
+register_backend('gzip', 'isal', _open_isal, module='isal')
+register_backend('gzip', 'zlib-ng', _open_zlib_ng, module='zlib_ng')
+register_backend('gzip', 'gzip', lambda source: gzip.open(source, 'rb'))
+# decompress in a background thread, only chosen if selected explicitly
+register_backend('gzip', 'isal-threaded', _open_isal_threaded, module='isal')
+register_backend('gzip', 'zlib-ng-threaded', _open_zlib_ng_threaded, module='zlib_ng')
+
+register_compression('zstd', b'\x28\xb5\x2f\xfd', _compress_zstd)
+register_backend(
+    'zstd', 'zstandard', _open_zstandard,
+    module='zstandard', decompressor=_zstandard_decompressor,
+)
+register_backend(
+    'zstd', 'compression.zstd', _open_stdlib_zstd,
+    module='compression.zstd', decompressor=_stdlib_zstd_decompressor,
+)
+
+register_compression('xz', b'\xfd7zXZ\x00', lzma.compress)
+register_backend('xz', 'lzma', lambda source: lzma.open(source, 'rb'))
+
+register_compression('bz2', b'BZh', bz2.compress)
+register_backend('bz2', 'bz2', lambda source: bz2.open(source, 'rb'))
+
+register_compression('lz4', b'\x04\x22\x4d\x18', _compress_lz4)
+register_backend('lz4', 'lz4', _open_lz4, module='lz4')
+
+
+def benchmark(paths, compressions=None, repeat=3):
+    '''
+    Measure the decompression speed of all available backends.
+
+    The files in ``paths`` (e.g. the test files of this package) are read,
+    compressed in memory with each format and decompressed with each backend,
+    the best of ``repeat`` runs is used.
+
+    Returns
+    -------
+    results: list of BenchmarkResult
+    '''
+    from .io import open_compressed
+
+    data = []
+    for path in paths:
+        with open_compressed(path) as f:
+            data.append(f.read())
+    size = sum(len(d) for d in data)
+
+    results = []
+    for compression in compressions or list(_backends):
+        compress = _compressors.get(compression)
+        names = available_backends(compression)
+        if compress is None or not names or not _is_installed_compressor(compression):
+            continue
+
+        compressed = [compress(d) for d in data]
+        for name in names:
+            best = float('inf')
+            for _ in range(repeat):
+                start = time.perf_counter()
+                for c in compressed:
+                    with open_decompressed(io.BytesIO(c), compression, name) as f:
+                        f.read()
+                best = min(best, time.perf_counter() - start)
+            results.append(BenchmarkResult(compression, name, size / best / 1e6))
+
+    return results
+
+
+def _is_installed_compressor(compression):
+    '''Compressors of optional formats need the same module as their default backend'''
+    try:
+        _compressors[compression](b'')
+    except ImportError:
+        return False
+    return True
+
+
+def main(args=None):
+    args = sys.argv[1:] if args is None else args
+    if not args:
+        print('Usage: python -m corsikaio.backends <corsika files>')
+        return 1
+
+    print(f'{"compression":<12} {"backend":<18} {"MB/s":>10}')
+    for result in benchmark(args):
+        print(f'{result.compression:<12} {result.backend:<18} {result.mb_per_s:>10.1f}')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
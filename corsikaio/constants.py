@@ -3,5 +3,8 @@ BLOCK_SIZE_FLOATS_THIN = 312
 BLOCK_SIZE_BYTES = BLOCK_SIZE_FLOATS * 4
 BLOCK_SIZE_BYTES_THIN = BLOCK_SIZE_FLOATS_THIN * 4
 
+# rows of longitudinal data after the header of each LONG block, also with thinning
+LONGITUDINAL_ROWS_PER_BLOCK = 26
+
 RUNH_VERSION_POSITION = 4
 EVTH_VERSION_POSITION = 46
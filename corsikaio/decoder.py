@@ -0,0 +1,111 @@
+"""
+Decoding of the blocks of a CORSIKA file.
+
+The dtypes of the sub blocks depend on the CORSIKA version and on thinning,
+both are fixed for a file. A `Decoder` resolves them once when the file
+is opened, so reading the events does not need to look them up for every block.
+"""
+import numpy as np
+
+from .constants import BLOCK_SIZE_BYTES, BLOCK_SIZE_BYTES_THIN, RUNH_VERSION_POSITION
+from .subblocks import get_version, parse_data_block, trim_padding
+from .subblocks.run_header import run_header_types, run_header_thin_types
+from .subblocks.run_end import run_end_dtype, run_end_thin_dtype
+from .subblocks.event_header import event_header_types, event_header_thin_types
+from .subblocks.event_end import event_end_types, event_end_thin_types
+
+
+__all__ = ['Decoder']
+
+
+class Decoder:
+    '''
+    Decodes the blocks of a CORSIKA file with a given version and thinning.
+
+    Parameters
+    ----------
+    version: float
+        CORSIKA version as stored in the run header
+    thinning: bool
+        Whether the file was written using thinning
+    payload_dtypes: tuple or None
+        Dtypes of a row of the data blocks without and with thinning,
+        e.g. ``(particle_data_dtype, particle_data_thin_dtype)``.
+        If None, the payload is decoded as plain float32 rows.
+
+    Attributes
+    ----------
+    block_size: int
+        Size of a block in bytes
+    row_width: int
+        Number of 4-byte words of a row in the data blocks
+    row_size: int
+        Size of a row in the data blocks in bytes
+    '''
+
+    def __init__(self, version, thinning=False, payload_dtypes=None):
+        self.version = version
+        self.thinning = bool(thinning)
+
+        # only the minor version is used to look up the dtypes, e.g. 7.4 for 7.4005
+        minor_version = float(str(version)[:3])
+        if self.thinning:
+            self.block_size = BLOCK_SIZE_BYTES_THIN
+            self.row_width = 8
+            self.run_header_dtype = run_header_thin_types[minor_version]
+            self.event_header_dtype = event_header_thin_types[minor_version]
+            self.event_end_dtype = event_end_thin_types[minor_version]
+            self.run_end_dtype = run_end_thin_dtype
+        else:
+            self.block_size = BLOCK_SIZE_BYTES
+            self.row_width = 7
+            self.run_header_dtype = run_header_types[minor_version]
+            self.event_header_dtype = event_header_types[minor_version]
+            self.event_end_dtype = event_end_types[minor_version]
+            self.run_end_dtype = run_end_dtype
+
+        self.row_size = 4 * self.row_width
+        self.payload_dtype = None
+        if payload_dtypes is not None:
+            self.payload_dtype = payload_dtypes[self.thinning]
+
+    @classmethod
+    def from_run_header(cls, block, thinning=False, payload_dtypes=None):
+        '''Create the decoder for a file from the bytes of its RUNH block'''
+        return cls(get_version(block, RUNH_VERSION_POSITION), thinning, payload_dtypes)
+
+    def run_header(self, block):
+        return np.frombuffer(block, dtype=self.run_header_dtype)[0]
+
+    def run_end(self, block):
+        return np.frombuffer(block, dtype=self.run_end_dtype)[0]
+
+    def event_header(self, block):
+        return np.frombuffer(block, dtype=self.event_header_dtype)[0]
+
+    def event_end(self, block):
+        return np.frombuffer(block, dtype=self.event_end_dtype)[0]
+
+    def event_headers(self, data):
+        '''Structured array of the concatenated EVTH blocks in ``data``'''
+        return np.frombuffer(data, dtype=self.event_header_dtype)
+
+    def event_ends(self, data):
+        '''Structured array of the concatenated EVTE blocks in ``data``'''
+        return np.frombuffer(data, dtype=self.event_end_dtype)
+
+    def rows(self, data):
+        '''View the data blocks in ``data`` as float32 array with one row per entry'''
+        return np.frombuffer(data, dtype=np.float32).reshape(-1, self.row_width)
+
+    def payload(self, data, columns=None):
+        '''
+        Decode the concatenated data blocks of an event, dropping the zero padding.
+
+        Returns a structured array (or a dict of the requested ``columns``)
+        if the decoder has a payload dtype, else a float32 array of rows.
+        '''
+        if self.payload_dtype is None:
+            rows = self.rows(data)
+            return trim_padding(rows, rows)
+        return parse_data_block(data, self.payload_dtype, columns=columns)
@@ -1,204 +1,1115 @@
+import io
+import operator
+from functools import cached_property, lru_cache
+import os
+import queue
+import threading
 import numpy as np
 from collections import namedtuple
 
-from .subblocks import (
-    parse_run_header,
-    parse_run_header_thin,
-    parse_event_header,
-    parse_event_header_thin,
-    parse_event_end,
-    parse_event_end_thin,
-    parse_cherenkov_photons,
-    parse_cherenkov_photons_thin,
-    parse_particle_data,
-    parse_particle_data_thin,
-    parse_longitudinal,
-    parse_run_end,
-    parse_run_end_thin,
-    get_version,
+from .subblocks import parse_longitudinal, count_filled_rows
+from .subblocks.longitudinal import longitudinal_header_dtype, longitudinal_data_dtype
+from .subblocks.data import (
+    cherenkov_photons_dtype,
+    cherenkov_photons_thin_dtype,
+    mmcs_cherenkov_photons_dtype,
+    particle_data_dtype,
+    particle_data_thin_dtype,
 )
-from .subblocks.longitudinal import longitudinal_header_dtype
-from .subblocks.data import mmcs_cherenkov_photons_dtype
-from .io import iter_blocks, read_buffer_size, open_compressed
+from .decoder import Decoder
+from .particles import (
+    decode_particle_description,
+    particle_descriptions,
+    split_auxiliary,
+    split_by_level,
+)
+from .io import (
+    RECORD_MARKER,
+    is_stream,
+    iter_blocks,
+    iter_blocks_mmap,
+    iter_records,
+    iter_records_mmap,
+    map_file,
+    open_compressed,
+    probe,
+    probe_stream,
+    wrap_compressed,
+)
+from .index import EventIndex, build_index, find_blocks, index_path
+from .seekable import open_seekable, seek_index_path
 
-from .constants import BLOCK_SIZE_BYTES, BLOCK_SIZE_BYTES_THIN, EVTH_VERSION_POSITION
+from .constants import BLOCK_SIZE_BYTES, BLOCK_SIZE_BYTES_THIN, LONGITUDINAL_ROWS_PER_BLOCK
 
 Event = namedtuple('Event', ['header', 'data', 'longitudinal', 'end'])
 PhotonEvent = namedtuple('PhotonEvent', ['header', 'photons', 'longitudinal', 'end'])
-ParticleEvent = namedtuple(
-    'ParticleEvent',
-    ['header', 'particles', 'longitudinal', 'end']
-)
+
+
+class ParticleEvent(namedtuple('ParticleEvent', ['header', 'particles', 'longitudinal', 'end'])):
+    """
+    An event of a CORSIKA particle file.
+
+    The fields of the packed ``particle_description`` are decoded on first access
+    of ``particle_id``, ``hadronic_generation`` or ``observation_level``
+    and cached on the event.
+
+    Files read with ``auxiliary=True`` store the MUADDI / EHISTORY records
+    separated from the particles in ``auxiliary``, see `corsikaio.particles.split_auxiliary`.
+    """
+    #: `corsikaio.particles.Auxiliary` records, only set if requested
+    auxiliary = None
+
+    def _replace(self, **kwargs):
+        event = super()._replace(**kwargs)
+        if self.auxiliary is not None:
+            event.auxiliary = self.auxiliary
+        return event
+
+    @cached_property
+    def _decoded_description(self):
+        return decode_particle_description(particle_descriptions(self.particles))
+
+    @property
+    def particle_id(self):
+        return self._decoded_description[0]
+
+    @property
+    def hadronic_generation(self):
+        return self._decoded_description[1]
+
+    @property
+    def observation_level(self):
+        '''Number of the observation level of each particle, starting at 1'''
+        return self._decoded_description[2]
+
+    def by_level(self):
+        '''
+        Split the particles by observation level.
+
+        Returns a dict mapping each of the ``n_observation_levels`` of the event header
+        (starting at 1) to the particles on that level, see `corsikaio.particles.split_by_level`.
+        The height of level ``i`` is ``header['observation_height'][i - 1]``.
+        Files with MUADDI or EHISTORY records need to be read with ``auxiliary=True``.
+        '''
+        n_levels = None
+        if self.header.dtype.names is not None:
+            n_levels = int(self.header['n_observation_levels'])
+        return split_by_level(self.particles, self.observation_level, n_levels)
+
+
+Batch = namedtuple('Batch', ['headers', 'data', 'offsets', 'ends'])
+
 
 def _to_floatarray(block):
     return np.frombuffer(block, dtype=np.float32)
 
 
+def _blocks_size(blocks):
+    return sum(len(block) for block in blocks)
+
+
+def _join_blocks(blocks, out=None):
+    '''
+    Concatenate blocks into a single, writable buffer.
+
+    The blocks, e.g. views into the memory map, are copied exactly once,
+    so parsed arrays can be views of the result. The blocks are copied into
+    the uint8 array ``out`` if given and large enough, otherwise into a new array.
+    '''
+    size = _blocks_size(blocks)
+    if out is not None and len(out) >= size:
+        buffer = out[:size]
+    else:
+        buffer = np.empty(size, dtype=np.uint8)
+
+    pos = 0
+    for block in blocks:
+        size = len(block)
+        buffer[pos:pos + size] = np.frombuffer(block, dtype=np.uint8)
+        pos += size
+    return buffer
+
+
+def _filled_size(blocks, n_columns):
+    '''Size in bytes of the data in ``blocks`` without the zero padding at the end'''
+    size = _blocks_size(blocks)
+    for block in reversed(blocks):
+        size -= len(block)
+        rows = np.frombuffer(block, dtype=np.float32).reshape(-1, n_columns)
+        n_rows = count_filled_rows(rows)
+        if n_rows > 0:
+            return size + n_rows * 4 * n_columns
+    return 0
+
+
+def _truncate_blocks(blocks, size):
+    '''The first ``size`` bytes of ``blocks``, as list of blocks'''
+    truncated = []
+    for block in blocks:
+        if size <= 0:
+            break
+        truncated.append(block[:size])
+        size -= len(block)
+    return truncated
+
+
+def _make_selection(where):
+    '''
+    Turn the ``where`` option of `CorsikaFile` into a function
+    of the parsed event header.
+    '''
+    if where is None or callable(where):
+        return where
+
+    ranges = dict(where)
+
+    def selection(header):
+        for name, (low, high) in ranges.items():
+            value = header[name]
+            if low is not None and value < low:
+                return False
+            if high is not None and value >= high:
+                return False
+        return True
+
+    return selection
+
+
+def _skip_event(block_iter):
+    '''Consume ``block_iter`` up to and including the next EVTE block'''
+    block = _next_block(block_iter)
+    while block[:4] != b'EVTE':
+        block = _next_block(block_iter)
+    return block
+
+
+@lru_cache(maxsize=1024)
+def _scan_run_end(path, size, mtime, thinning):
+    '''
+    Find the RUNE block of a compressed file in a single streaming pass.
+
+    Cached using the size and modification time of the file,
+    so that the file is only scanned again if it changed.
+    '''
+    block_size = BLOCK_SIZE_BYTES if thinning is False else BLOCK_SIZE_BYTES_THIN
+
+    block = None
+    with open_compressed(path) as f:
+        for _, data in iter_records(f, thinning=thinning):
+            found = find_blocks(data, b'RUNE', block_size)
+            if len(found) > 0:
+                offset = found[-1] * block_size
+                block = bytes(data[offset:offset + block_size])
+    return block
+
+
+def _stack_longitudinal(data, block_size, block_event, n_events):
+    '''
+    Place the rows of the concatenated LONG blocks in ``data`` into an array
+    of shape ``(n_events, n_steps)``, using the event of each block and the
+    step count and block number from the block headers.
+    '''
+    blocks = np.frombuffer(data, dtype=np.uint8).reshape(-1, block_size)
+    header_size = longitudinal_header_dtype.itemsize
+    rows_size = LONGITUDINAL_ROWS_PER_BLOCK * longitudinal_data_dtype.itemsize
+
+    headers = np.ascontiguousarray(blocks[:, :header_size]).view(longitudinal_header_dtype)[:, 0]
+    rows = np.ascontiguousarray(blocks[:, header_size:header_size + rows_size])
+    rows = rows.view(longitudinal_data_dtype)
+
+    # n_longitudinal is the number of steps times 100 plus the number of LONG blocks
+    n_steps = headers['n_longitudinal'].astype(np.int64) // 100
+    block_number = headers['longitudinal_id'].astype(np.int64) - 1
+
+    longitudinal = np.empty((n_events, int(n_steps.max(initial=0))), dtype=longitudinal_data_dtype)
+    longitudinal.view(np.float32)[...] = np.nan
+
+    step = block_number[:, np.newaxis] * LONGITUDINAL_ROWS_PER_BLOCK + np.arange(LONGITUDINAL_ROWS_PER_BLOCK)
+    valid = step < n_steps[:, np.newaxis]
+    event = np.broadcast_to(block_event[:, np.newaxis], step.shape)
+    longitudinal[event[valid], step[valid]] = rows[valid]
+    return longitudinal
+
+
+def _next_block(block_iter):
+    try:
+        return next(block_iter)
+    except StopIteration:
+        raise IOError("File seems to be truncated")
+
+
 class CorsikaFile:
     """
     A file to iterate over events in a CORSIKA binary output file.
+
+    The file is opened once and its compression, fortran record size and
+    thinning are detected from the first bytes, available as ``layout``.
+    Thinning is detected automatically unless ``thinning`` is given explicitly.
+
+    Uncompressed files are memory mapped by default, so that blocks
+    are not copied before they are parsed.
+    Pass ``mmap=False`` to read them using regular file reads instead.
+
+    The dtypes of all blocks are resolved once from the run header,
+    available as ``decoder``, see `corsikaio.decoder.Decoder`.
+
+    Besides iterating, events can be accessed by their position in the file
+    using ``f[i]``, slices or `get_event`. This uses an `EventIndex` of the file,
+    which is built in a single pass over the file on first use and can be stored next
+    to the file by passing ``save_index=True``. Existing index files are
+    reused if the CORSIKA file was not modified in the meantime.
+    For compressed files, decompression restarts at checkpoints close to the
+    requested event, see `corsikaio.seekable`.
+
+    Events can be selected based on their header using ``where``,
+    either a function taking the parsed event header and returning a bool,
+    e.g. ``where=lambda h: h['total_energy'] > 1000``,
+    or a dict mapping event header fields to ``(low, high)`` ranges,
+    e.g. ``where={'total_energy': (1000, None)}``, where ``None`` means unbounded
+    and ``low <= value < high`` is selected.
+    The data and longitudinal blocks of events not passing the selection are
+    skipped without being decoded. The selection applies to iteration and
+    `iter_headers`, not to random access.
+
+    With ``prefetch=N``, a background thread reads, decompresses and frames
+    up to ``N`` events ahead while the current event is parsed and processed,
+    which is most useful for compressed files.
+
+    With ``reuse_buffers=True``, the payload and longitudinal data of each event
+    are decoded into memory reused from the previous event, which is only
+    reallocated when an event does not fit. The arrays of an event are then
+    only valid until the next event is read, copy them to keep them.
+    This applies to iteration, see also `read_next_into`.
+
+    Instead of a path, ``path`` can also be a readable binary file-like object,
+    e.g. ``sys.stdin.buffer``. Such objects and paths to named pipes are read
+    as a stream, without seeking or opening them again. Only iteration is
+    supported for streams and the ``run_end`` is available after all
+    events were read. File-like objects are not closed by `close`.
     """
+    #: dtypes of a row of the data blocks without and with thinning,
+    #: None to return the payload as float32 rows
+    _payload_dtypes = None
 
-    def __init__(self, path, parse_blocks=True, thinning=False):
+    def __init__(
+        self,
+        path,
+        parse_blocks=True,
+        thinning=None,
+        mmap=True,
+        save_index=False,
+        where=None,
+        prefetch=0,
+        reuse_buffers=False,
+    ):
         self.EventClass = Event
+        self.reuse_buffers = reuse_buffers
+        # buffers reused for each event if reuse_buffers is True
+        self._buffers = {}
 
         self.parse_blocks = parse_blocks
-        self.thinning = thinning
-        self._buffer_size = read_buffer_size(path)
-        self._f = open_compressed(path)
-        self._block_iter = iter_blocks(self._f, thinning=self.thinning)
-        if self.thinning is False:
-            self.block_size = BLOCK_SIZE_BYTES
+        self.where = where
+        self._selection = _make_selection(where)
+        self.save_index = save_index
+        self._index = None
+        self._mmap = None
+        self._fd = None
+        # file object opened here, closed in close
+        self._raw = None
+        # random access to compressed files, created on first use
+        self._seekable = None
+
+        # the file is opened only once, its layout detected from the first bytes
+        if is_stream(path):
+            self._path = None
+            if not hasattr(path, 'read'):
+                # named pipes can only be opened once
+                self._raw = path = open(path, 'rb')
+            self._f, self.layout = probe_stream(path)
         else:
-            self.block_size = BLOCK_SIZE_BYTES_THIN
+            self._path = path
+            self._raw = open(path, 'rb')
+            self.layout = probe(self._raw)
+
+            if self.layout.compression is None:
+                self._f = self._raw
+                self._mmap = map_file(self._raw) if mmap else None
+
+                # positional reads of uncompressed files that are not memory mapped
+                if self._mmap is None and hasattr(os, 'pread'):
+                    self._fd = self._raw.fileno()
+            else:
+                self._f = wrap_compressed(self._raw, self.layout.compression)
+
+        self._buffer_size = self.layout.buffer_size
+        if thinning is None:
+            thinning = self.layout.thinning
+        self.thinning = thinning
 
+        self._block_iter = self._iter_blocks()
         runh_bytes = next(self._block_iter)
         if not runh_bytes[:4] == b'RUNH':
             raise ValueError('File does not start with b"RUNH"')
 
-        if self.thinning is False:
-            self.run_header = parse_run_header(runh_bytes)[0]
-        else:
-            self.run_header = parse_run_header_thin(runh_bytes)[0]
-        self.version = round(float(self.run_header['version']), 4)
+        # dtypes, block and row size are fixed for the file, resolve them only once
+        self.decoder = Decoder.from_run_header(runh_bytes, self.thinning, self._payload_dtypes)
+        self.run_header = self.decoder.run_header(runh_bytes)
+        self.version = self.decoder.version
+        self.block_size = self.decoder.block_size
         self._run_end = None
 
+        self.prefetch = prefetch
+        # with prefetching, _block_iter is only consumed by the prefetch thread,
+        # other reads are positional and do not share a file position
+        self._index_lock = threading.Lock()
+        self._seekable_lock = threading.Lock()
+        self._prefetch_thread = None
+        self._prefetch_error = None
+
     @property
     def run_end(self):
-        
+        '''
+        The run end block.
+
+        For uncompressed files and compressed files with known size, e.g. zstd files
+        with a seek table, this is found with a single read of the end of the file.
+        Other compressed files are scanned once in a streaming fashion,
+        the result is cached per file.
+        '''
         if self._run_end is None:
-            pos = self._f.tell()
+            if self._path is None:
+                raise io.UnsupportedOperation(
+                    'The run end of a stream is only available after reading all events'
+                )
 
-            if self._buffer_size is None:
-                self._f.seek(0, 2)
+            if (self._index is not None and self._index.run_end >= 0) or self._size() is not None:
+                block = self._read_run_end_block()
             else:
-                self._f.seek(-4, 2)
+                stat = os.stat(self._path)
+                block = _scan_run_end(
+                    os.path.abspath(self._path), stat.st_size, stat.st_mtime_ns, self.thinning
+                )
 
-            self._f.seek(-self.block_size, 1)
-            block = self._f.read(self.block_size)
-            while block[:4] != b'RUNE':
-                self._f.seek(-2 * self.block_size, 1)
-                block = self._f.read(self.block_size)
+            if block is None:
+                raise IOError("No RUNE block found, file seems to be truncated")
 
-            if self.thinning is False:
-                self._run_end = parse_run_end(block)[0]
-            else:
-                self._run_end = parse_run_end_thin(block)[0]
-            self._f.seek(pos)
+            self._run_end = self.decoder.run_end(block)
 
         return self._run_end
 
-    def __next__(self):
-        try:
-            block = next(self._block_iter)
-        except StopIteration:
-            raise IOError("File seems to be truncated")
-
-        if block[:4] == b'RUNE':
-            if self.thinning is False:
-                self._run_end = parse_run_end(block)
-            else:
-                self._run_end = parse_run_end_thin(block)
-            raise StopIteration()
+    def _size(self):
+        '''Size of the uncompressed data, None if unknown'''
+        if self._mmap is not None:
+            return len(self._mmap)
+        if self._fd is not None:
+            return os.fstat(self._fd).st_size
+        return self._seekable_reader().size
 
-        if block[:4] != b'EVTH':
-            raise IOError('EVTH block expected but found {}'.format(block[:4]))
+    def _seekable_reader(self):
+        '''The `corsikaio.seekable.SeekableReader` for random access to a compressed file'''
+        if self._seekable is not None:
+            return self._seekable
 
-        if self.parse_blocks:
-            if self.thinning is False:
-                event_header = parse_event_header(block)[0]
-            else:
-                event_header = parse_event_header_thin(block)[0]
+        with self._seekable_lock:
+            if self._seekable is None:
+                reader = open_seekable(self._path, self.layout.compression)
+                path = seek_index_path(self._path)
+                if os.path.exists(path):
+                    try:
+                        reader.load(path, source=self._path)
+                    except ValueError:
+                        pass
+                self._seekable = reader
+
+        return self._seekable
+
+    def _read_run_end_block(self):
+        '''Read the RUNE block from the last record'''
+        if self._index is not None and self._index.run_end >= 0:
+            return self._read_range(self._index.run_end, self._index.run_end + self.block_size)
+
+        size = self._size()
+
+        if self._buffer_size is None:
+            stop = size - size % self.block_size
+            start = stop - self.block_size * min(stop // self.block_size, 100)
         else:
-            event_header = _to_floatarray(block)
+            stop = size - RECORD_MARKER.size
+            record_size, = RECORD_MARKER.unpack(self._read_range(stop, size))
+            start = stop - record_size
+            if record_size % self.block_size != 0 or start < 0:
+                raise IOError("Invalid record marker, file seems to be truncated")
+
+        data = self._read_range(start, stop)
+        found = find_blocks(data, b'RUNE', self.block_size)
+        if len(found) == 0:
+            return None
+
+        offset = found[-1] * self.block_size
+        return data[offset:offset + self.block_size]
+
+    def _iter_blocks(self):
+        '''Iterate over all blocks of the file, starting at the beginning'''
+        if self._mmap is not None:
+            return iter_blocks_mmap(self._mmap, thinning=self.thinning)
+        return iter_blocks(self._f, thinning=self.thinning)
+
+    def _reopen(self):
+        '''Open the file again, independently of the file object used for iteration'''
+        if self._path is None:
+            raise io.UnsupportedOperation('Only iteration is supported when reading from a stream')
+
+        # record checkpoints for random access to compressed files on the way
+        if self.layout.compression is not None:
+            return self._seekable_reader().stream()
+        return open_compressed(self._path, layout=self.layout)
+
+    def _save_index(self):
+        '''Store the index and the checkpoints of compressed files next to the file'''
+        self._index.save(index_path(self._path), source=self._path)
+        if self._seekable is not None:
+            self._seekable.save(seek_index_path(self._path), source=self._path)
+
+    @property
+    def index(self):
+        '''
+        The `EventIndex` of this file.
+
+        Loaded from the index file if available and up to date,
+        otherwise created on first access.
+        '''
+        if self._index is not None:
+            return self._index
+
+        with self._index_lock:
+            if self._index is None and self._path is not None:
+                path = index_path(self._path)
+                if os.path.exists(path):
+                    try:
+                        self._index = EventIndex.load(path, source=self._path)
+                    except ValueError:
+                        pass
+
+            if self._index is None:
+                self.create_index(save=self.save_index)
+
+        return self._index
+
+    def create_index(self, save=False):
+        '''
+        Create the `EventIndex` of this file in a single pass over the file.
+
+        If ``save`` is True, the index is stored in a file next to the CORSIKA
+        file, see `corsikaio.index.index_path`.
+        '''
+        if self._mmap is not None:
+            records = iter_records_mmap(self._mmap, thinning=self.thinning)
+            index = build_index(records, thinning=self.thinning, version=self.version)
+        else:
+            with self._reopen() as f:
+                records = iter_records(f, thinning=self.thinning)
+                index = build_index(records, thinning=self.thinning, version=self.version)
+
+        self._index = index
+        if save:
+            self._save_index()
+        return index
+
+    def _read_range(self, start, stop):
+        '''
+        Read the bytes from ``start`` to ``stop`` of the uncompressed file.
+
+        Uncompressed files are read using the memory map or positional reads,
+        compressed files using the checkpoints of a `corsikaio.seekable.SeekableReader`.
+        All of these are safe to use from multiple threads and do not affect iteration.
+        '''
+        if self._mmap is not None:
+            return memoryview(self._mmap)[start:stop]
+
+        if self._fd is not None:
+            data = os.pread(self._fd, stop - start, start)
+            # pread might return less bytes than requested before the end of the file
+            while 0 < len(data) < stop - start:
+                chunk = os.pread(self._fd, stop - start - len(data), start + len(data))
+                if len(chunk) == 0:
+                    break
+                data += chunk
+        else:
+            data = self._seekable_reader().read(start, stop)
+
+        if len(data) < stop - start:
+            raise IOError("Read less bytes than expected, file seems to be truncated")
+        return data
+
+    def _iter_event_blocks(self, event):
+        '''Iterate over the blocks of the event at position ``event`` in the file'''
+        offsets = self.index.event_blocks(event)
+        start = offsets[0]
+        data = self._read_range(start, offsets[-1] + self.block_size)
+
+        for offset in offsets - start:
+            yield data[offset:offset + self.block_size]
+
+    def __len__(self):
+        if self._path is None:
+            # TypeError, so that e.g. list(f) still works for streams
+            raise TypeError('The number of events of a stream is unknown')
+        return len(self.index)
+
+    def __getitem__(self, key):
+        if isinstance(key, slice):
+            return [self[i] for i in range(*key.indices(len(self)))]
+
+        key = operator.index(key)
+        n_events = len(self.index)
+        if key < 0:
+            key += n_events
+        if not 0 <= key < n_events:
+            raise IndexError('Event index out of range')
+
+        block_iter = self._iter_event_blocks(key)
+        return self._read_event(next(block_iter), block_iter)
+
+    def _reopen_kwargs(self):
+        '''Keyword arguments to open this file again, e.g. in another process'''
+        return dict(
+            parse_blocks=self.parse_blocks,
+            thinning=self.thinning,
+            mmap=self._mmap is not None,
+        )
+
+    def read_parallel(self, func, workers=None, shared_memory=False):
+        '''
+        Apply ``func`` to all events of this file using multiple processes.
+
+        The event boundaries are located using the `index`, then contiguous
+        ranges of events are decoded by worker processes, each opening
+        the file independently. This is most efficient for uncompressed files.
+
+        Parameters
+        ----------
+        func: callable
+            Called with each event, needs to be picklable.
+        workers: int or None
+            Number of worker processes, defaults to the number of CPUs.
+        shared_memory: bool
+            Transport numpy arrays in the results using shared memory,
+            see `corsikaio.parallel.map_files`.
+
+        Returns
+        -------
+        results: list
+            The return values of ``func`` in the order of the events in the file.
+        '''
+        from .parallel import map_shards
+        return map_shards(self, func, workers=workers, shared_memory=shared_memory)
+
+    def get_event(self, event_number):
+        '''Get the event with the given ``event_number``'''
+        return self[self.index.find(event_number)]
+
+    def __next__(self):
+        header_block, data_blocks, long_blocks, end_block = self._fetch_event_blocks()
+
+        data_out = long_out = None
+        if self.reuse_buffers:
+            data_out = self._reusable_buffer('data', _blocks_size(data_blocks))
+            long_out = self._reusable_buffer('longitudinal', _blocks_size(long_blocks))
+
+        return self._parse_event(
+            header_block, data_blocks, long_blocks, end_block,
+            data_out=data_out, long_out=long_out,
+        )
 
-        data_bytes = bytearray()
-        long_bytes = bytearray()
+    def read_next_into(self, buffer):
+        '''
+        Read the next event, decoding its payload into ``buffer``.
 
-        try:
-            block = next(self._block_iter)
-        except StopIteration:
-            raise IOError("File seems to be truncated")
+        ``buffer`` can be any writable, contiguous buffer, e.g. a numpy array.
+        The payload of the returned event is a view into ``buffer`` and only
+        valid until ``buffer`` is reused. If the payload does not fit into ``buffer``,
+        a new array is allocated instead. Raises ``StopIteration`` after the last event.
+        '''
+        out = np.frombuffer(buffer, dtype=np.uint8)
+        if not out.flags.writeable:
+            raise ValueError('buffer needs to be writable')
 
+        header_block, data_blocks, long_blocks, end_block = self._fetch_event_blocks()
+
+        long_out = None
+        if self.reuse_buffers:
+            long_out = self._reusable_buffer('longitudinal', _blocks_size(long_blocks))
+
+        return self._parse_event(
+            header_block, data_blocks, long_blocks, end_block,
+            data_out=out, long_out=long_out,
+        )
+
+    def _reusable_buffer(self, name, size):
+        '''Buffer of at least ``size`` bytes that is reused for every event'''
+        buffer = self._buffers.get(name)
+        if buffer is None or len(buffer) < size:
+            # grow geometrically, so slowly growing events do not reallocate every time
+            capacity = size if buffer is None else max(size, int(1.5 * len(buffer)))
+            buffer = self._buffers[name] = np.empty(capacity, dtype=np.uint8)
+        return buffer
+
+    def _fetch_event_blocks(self):
+        '''Get the blocks of the next event, from the prefetch queue if enabled'''
+        if self.prefetch <= 0:
+            return self._next_event_blocks()
+
+        if self._prefetch_error is not None:
+            raise self._prefetch_error
+
+        if self._prefetch_thread is None:
+            self._prefetch_queue = queue.Queue(maxsize=self.prefetch)
+            self._prefetch_stop = threading.Event()
+            self._prefetch_thread = threading.Thread(target=self._prefetch_events, daemon=True)
+            self._prefetch_thread.start()
+
+        blocks, error = self._prefetch_queue.get()
+        if error is not None:
+            self._prefetch_error = error
+            raise error
+        return blocks
+
+    def _prefetch_events(self):
+        '''Target of the prefetch thread, puts the blocks of upcoming events into the queue'''
+        error = None
+        while error is None and not self._prefetch_stop.is_set():
+            try:
+                item = (self._next_event_blocks(), None)
+            except Exception as e:
+                item = (None, e)
+            error = item[1]
+
+            while not self._prefetch_stop.is_set():
+                try:
+                    self._prefetch_queue.put(item, timeout=0.1)
+                    break
+                except queue.Full:
+                    pass
+
+    def _next_event_blocks(self):
+        '''
+        Read the blocks of the next event passing the selection,
+        see `_read_event_blocks`.
+        '''
+        while True:
+            block = _next_block(self._block_iter)
+
+            if block[:4] == b'RUNE':
+                self._run_end = self.decoder.run_end(block)
+                raise StopIteration()
+
+            if block[:4] != b'EVTH':
+                raise IOError('EVTH block expected but found {}'.format(bytes(block[:4])))
+
+            if self._is_selected(block):
+                return self._read_event_blocks(block, self._block_iter)
+
+            _skip_event(self._block_iter)
+
+    def _is_selected(self, block):
+        '''Check if the event with EVTH ``block`` passes the ``where`` selection'''
+        if self._selection is None:
+            return True
+
+        return bool(self._selection(self.decoder.event_header(block)))
+
+    def _read_event_blocks(self, block, block_iter):
+        '''
+        Collect the blocks of the event starting with the EVTH ``block``,
+        consuming ``block_iter`` up to and including the EVTE block.
+
+        Returns the EVTH block, the list of data blocks, the list of longitudinal
+        data blocks without their headers and the EVTE block.
+        The blocks are joined when parsing, see `_parse_event`.
+        '''
+        header_block = block
+        data_blocks = []
+        long_blocks = []
+
+        block = _next_block(block_iter)
         while block[:4] != b'EVTE':
 
             if block[:4] == b'LONG':
-                long_bytes += block[longitudinal_header_dtype.itemsize:]
+                long_blocks.append(block[longitudinal_header_dtype.itemsize:])
             else:
-                data_bytes += block
+                data_blocks.append(block)
 
-            try:
-                block = next(self._block_iter)
-            except StopIteration:
-                raise IOError("File seems to be truncated")
+            block = _next_block(block_iter)
+
+        return header_block, data_blocks, long_blocks, block
+
+    def _read_event(self, block, block_iter):
+        '''
+        Read the event starting with the EVTH ``block``,
+        consuming ``block_iter`` up to and including the EVTE block.
+        '''
+        return self._parse_event(*self._read_event_blocks(block, block_iter))
+
+    def _parse_event(
+        self, header_block, data_blocks, long_blocks, end_block, data_out=None, long_out=None
+    ):
+        '''
+        Parse an event from the blocks returned by `_read_event_blocks`.
+
+        The data and longitudinal blocks are joined into ``data_out`` and ``long_out``
+        if given and large enough, see `_join_blocks`.
+        '''
+        data_bytes = _join_blocks(data_blocks, out=data_out)
+        long_bytes = _join_blocks(long_blocks, out=long_out)
+
+        event_header = self._parse_event_header(header_block)
+        event_end = self._parse_event_end(end_block)
+        data = self._parse_payload(data_bytes)
 
         if self.parse_blocks:
-            if self.thinning is False:
-                event_end = parse_event_end(block,self.version)[0]
-            else:
-                event_end = parse_event_end_thin(block,self.version)[0]
-            data = self.parse_data_blocks(data_bytes)
             longitudinal = parse_longitudinal(long_bytes)
         else:
-            event_end = _to_floatarray(block)
-            if self.thinning is False:
-                data = _to_floatarray(data_bytes).reshape(-1, 7)
-            else:
-                data = _to_floatarray(data_bytes).reshape(-1, 8)
-
             longitudinal = _to_floatarray(long_bytes)
 
         return self.EventClass(event_header, data, longitudinal, event_end)
 
-    def parse_data_blocks(self, data_bytes):
-        if self.thinning is False:
-            array = np.frombuffer(data_bytes, dtype='float32').reshape(-1, 7)
+    def _parse_payload(self, data_bytes):
+        if self.parse_blocks:
+            return self.parse_data_blocks(data_bytes)
+
+        return self.decoder.rows(data_bytes)
+
+    def _parse_event_header(self, block):
+        if not self.parse_blocks:
+            return _to_floatarray(block)
+
+        return self.decoder.event_header(block)
+
+    def _parse_event_end(self, block):
+        if not self.parse_blocks:
+            return _to_floatarray(block)
+
+        return self.decoder.event_end(block)
+
+    def iter_headers(self):
+        '''
+        Iterate over all events of the file, yielding only ``(header, end)`` tuples.
+
+        Data and longitudinal blocks are skipped without parsing or buffering them.
+        For uncompressed files or if the `index` is already available,
+        only the EVTH and EVTE blocks are read, seeking past everything else.
+        The `index` is created first if needed, as for random access.
+        Compressed files are streamed, discarding the blocks directly.
+
+        Iteration via ``next`` is not affected.
+        '''
+        uncompressed = self._path is not None and self.layout.compression is None
+        if self._mmap is not None or self._index is not None or uncompressed:
+            index = self.index
+
+            for header, end in zip(index.event_header, index.event_end):
+                block = self._read_range(header, header + self.block_size)
+                if not self._is_selected(block):
+                    continue
+
+                yield (
+                    self._parse_event_header(block),
+                    self._parse_event_end(self._read_range(end, end + self.block_size)),
+                )
+            return
+
+        with self._reopen() as f:
+            block_iter = iter_blocks(f, thinning=self.thinning)
+            # skip run header
+            _next_block(block_iter)
+
+            while True:
+                block = _next_block(block_iter)
+                if block[:4] == b'RUNE':
+                    return
+
+                if block[:4] != b'EVTH':
+                    raise IOError('EVTH block expected but found {}'.format(bytes(block[:4])))
+
+                if not self._is_selected(block):
+                    _skip_event(block_iter)
+                    continue
+
+                header = self._parse_event_header(block)
+                yield header, self._parse_event_end(_skip_event(block_iter))
+
+    def iter_chunked(self, max_rows=None, max_bytes=None):
+        '''
+        Iterate over all events, yielding the payload of each event in chunks.
+
+        Memory usage is bounded by the chunk size regardless of the size
+        of the showers. The `index` is used to locate the blocks of each event,
+        so that the event end is available before the payload is read.
+        Streams cannot be indexed, for these the raw blocks of each event
+        are kept in memory and only the parsing is done in chunks, starting
+        at the next event not yet returned by iteration.
+
+        Parameters
+        ----------
+        max_rows: int or None
+            Maximum number of photon bunches / particles per chunk.
+        max_bytes: int or None
+            Maximum size of the data blocks read for one chunk.
+
+        At least one block is read per chunk, so chunks can be larger
+        if the limits are smaller than a single block.
+
+        Yields
+        ------
+        header: np.ndarray
+            The event header
+        chunks: iterator
+            Iterator over the parsed payload of the event, each chunk
+            has the same type as the payload returned by normal iteration.
+            Chunks must be consumed before the file is closed.
+        end: np.ndarray
+            The event end
+        '''
+        if max_rows is None and max_bytes is None:
+            raise ValueError('At least one of max_rows and max_bytes is required')
+
+        rows_per_block = self.block_size // self.decoder.row_size
+
+        blocks_per_chunk = np.inf
+        if max_rows is not None:
+            blocks_per_chunk = min(blocks_per_chunk, max_rows // rows_per_block)
+        if max_bytes is not None:
+            blocks_per_chunk = min(blocks_per_chunk, max_bytes // self.block_size)
+        blocks_per_chunk = max(1, int(blocks_per_chunk))
+
+        if self._path is None:
+            yield from self._iter_chunked_stream(blocks_per_chunk)
+            return
+
+        index = self.index
+
+        def iter_chunks(offsets):
+            for start in range(0, len(offsets), blocks_per_chunk):
+                chunk = offsets[start:start + blocks_per_chunk]
+                first = chunk[0]
+                data = self._read_range(first, chunk[-1] + self.block_size)
+                blocks = [data[offset:offset + self.block_size] for offset in chunk - first]
+                yield self._parse_payload(_join_blocks(blocks))
+
+        for event, (header, end) in enumerate(zip(index.event_header, index.event_end)):
+            block = self._read_range(header, header + self.block_size)
+            if not self._is_selected(block):
+                continue
+
+            event_header = self._parse_event_header(block)
+            event_end = self._parse_event_end(self._read_range(end, end + self.block_size))
+
+            offsets = index.event_blocks(event)[1:-1]
+            offsets = offsets[~np.isin(offsets, index.event_longitudinal(event))]
+
+            yield event_header, iter_chunks(offsets), event_end
+
+    def _iter_chunked_stream(self, blocks_per_chunk):
+        '''
+        `iter_chunked` for streams, which cannot be indexed.
+
+        The event end follows the payload, so the data blocks of each event
+        are read sequentially first and only the parsing is done in chunks.
+        As for normal iteration, only the remaining events are returned.
+        '''
+        def iter_chunks(blocks):
+            for start in range(0, len(blocks), blocks_per_chunk):
+                yield self._parse_payload(_join_blocks(blocks[start:start + blocks_per_chunk]))
+
+        while True:
+            try:
+                header, data_blocks, _, end = self._fetch_event_blocks()
+            except StopIteration:
+                return
+
+            yield (
+                self._parse_event_header(header),
+                iter_chunks(data_blocks),
+                self._parse_event_end(end),
+            )
+
+    def iter_batches(self, max_events=None, max_rows=None):
+        '''
+        Iterate over the remaining events in batches of several events.
+
+        The payloads of all events of a batch are parsed at once,
+        avoiding the per-event overhead for many small events.
+        Longitudinal data is not read.
+
+        Parameters
+        ----------
+        max_events: int or None
+            Maximum number of events per batch
+        max_rows: int or None
+            Maximum number of photon bunches / particles per batch.
+            Events larger than this are returned as a batch of their own.
+
+        Yields
+        ------
+        batch: Batch
+            Namedtuple with the event headers and event ends of the events in the batch,
+            the concatenated payload ``data`` and ``offsets``, so that the payload
+            of the i-th event of the batch is ``data[offsets[i]:offsets[i + 1]]``.
+            If ``columns`` were requested, ``data`` is a dict of columns and
+            each column has to be sliced, e.g.
+            ``{name: column[offsets[i]:offsets[i + 1]] for name, column in data.items()}``.
+        '''
+        if max_events is None and max_rows is None:
+            raise ValueError('At least one of max_events and max_rows is required')
+
+        row_size = self.decoder.row_size
+        pending = None
+        finished = False
+
+        while not finished:
+            events = []
+            n_rows = 0
+
+            while max_events is None or len(events) < max_events:
+                if pending is not None:
+                    event, pending = pending, None
+                else:
+                    try:
+                        event = self._fetch_event_blocks()
+                    except StopIteration:
+                        finished = True
+                        break
+
+                event_rows = _blocks_size(event[1]) // row_size
+                if max_rows is not None and len(events) > 0 and n_rows + event_rows > max_rows:
+                    pending = event
+                    break
+
+                events.append(event)
+                n_rows += event_rows
+
+            if len(events) == 0:
+                return
+
+            yield self._parse_batch(events)
+
+    def _parse_batch(self, events):
+        row_size = self.decoder.row_size
+        header_bytes = b''.join(event[0] for event in events)
+        end_bytes = b''.join(event[3] for event in events)
+        n_events = len(events)
+
+        if self.parse_blocks:
+            # leave out the zero padding at the end of each event
+            sizes = [_filled_size(event[1], self.decoder.row_width) for event in events]
+            n_rows = np.array(sizes, dtype=np.int64) // row_size
+            data_bytes = _join_blocks([
+                block
+                for event, size in zip(events, sizes)
+                for block in _truncate_blocks(event[1], size)
+            ])
+            headers = self.decoder.event_headers(header_bytes)
+            ends = self.decoder.event_ends(end_bytes)
         else:
-            array = np.frombuffer(data_bytes, dtype='float32').reshape(-1, 8)
-        return array[np.any(array != 0, axis=1)]
+            n_rows = np.array([_blocks_size(event[1]) // row_size for event in events], dtype=np.int64)
+            data_bytes = _join_blocks([block for event in events for block in event[1]])
+            headers = _to_floatarray(header_bytes).reshape(n_events, -1)
+            ends = _to_floatarray(end_bytes).reshape(n_events, -1)
+
+        offsets = np.zeros(n_events + 1, dtype=np.int64)
+        np.cumsum(n_rows, out=offsets[1:])
+
+        return Batch(headers, self._parse_payload(data_bytes), offsets, ends)
+
+    def parse_data_blocks(self, data_bytes):
+        return self.decoder.payload(data_bytes)
 
     def __iter__(self):
         return self
 
-    def read_headers(self):
-        pos = self._f.tell()
-        self._f.seek(0)
+    def read_event_headers(self):
+        '''
+        Read the headers and ends of all events without reading the data blocks.
 
-        block_iter = iter_blocks(self._f, thinning=self.thinning)
-        block = next(block_iter)
-        event_header_data = bytearray()
-        end_found = True
+        The block markers are searched in bulk, see `corsikaio.index.build_index`,
+        which also creates the `index` of this file if it does not exist yet.
 
-        while block:
-            if block[:4] == b'RUNE':
-                if self.thinning is False:
-                    self._run_end = parse_run_end(block)[0]
-                else:
-                    self._run_end = parse_run_end_thin(block)[0]
-                break
+        Returns
+        -------
+        event_headers: np.ndarray
+            Structured array of all event headers
+        event_ends: np.ndarray
+            Structured array of all event ends
+        '''
+        if self._index is not None:
+            header_data = self._read_blocks(self._index.event_header)
+            end_data = self._read_blocks(self._index.event_end)
+            run_end_data = None
+            if self._index.run_end >= 0:
+                run_end_data = self._read_blocks([self._index.run_end])
+        else:
+            if self._mmap is not None:
+                records = iter_records_mmap(self._mmap, thinning=self.thinning)
+                self._index, blocks = build_index(
+                    records, thinning=self.thinning, version=self.version, return_blocks=True
+                )
+            else:
+                with self._reopen() as f:
+                    records = iter_records(f, thinning=self.thinning)
+                    self._index, blocks = build_index(
+                        records, thinning=self.thinning, version=self.version, return_blocks=True
+                    )
 
-            if (
-                block[:4] == b'EVTH'
-                and get_version(block, EVTH_VERSION_POSITION) == self.version
-            ):
-                if not end_found:
-                    raise IOError('Expected EVTE block before next EVTH')
+            header_data, end_data, run_end_data = blocks
+            if self.save_index:
+                self._save_index()
 
-                event_header_data += block
+        if run_end_data is not None:
+            self._run_end = self.decoder.run_end(run_end_data)
 
-                end_found = False
-            elif block[:4] == b'EVTE':
-                end_found = True
+        return self.decoder.event_headers(header_data), self.decoder.event_ends(end_data)
 
-            block = next(block_iter)
+    def _read_blocks(self, offsets):
+        '''Read the blocks starting at ``offsets`` into one bytes object'''
+        offsets = np.asarray(offsets, dtype=np.int64)
+        if self._mmap is not None:
+            blocks = np.frombuffer(self._mmap, dtype=np.uint8)
+            return blocks[offsets[:, np.newaxis] + np.arange(self.block_size)].tobytes()
+        return b''.join(self._read_range(o, o + self.block_size) for o in offsets)
 
-        self._f.seek(pos)
+    def read_longitudinal(self):
+        '''
+        Read the longitudinal distributions of all events at once.
 
-        if self.thinning is False:
-            event_headers = parse_event_header(event_header_data)
-        else:
-            event_headers = parse_event_header_thin(event_header_data)
+        Only the LONG blocks are read, using the `index`, the payload of the events
+        is skipped. Unlike the ``longitudinal`` of the events, rows containing
+        only zeros are kept, so that each column of the result is one step of
+        the depth grid. Events selected using ``where`` are respected.
 
+        Returns
+        -------
+        longitudinal: np.ndarray
+            Structured array with ``longitudinal_data_dtype`` of shape ``(n_events, n_steps)``.
+            Steps beyond the number of steps of an event, e.g. for events
+            without longitudinal data, are NaN.
+        '''
+        index = self.index
+        events = np.arange(len(index))
+        if self._selection is not None:
+            headers, _ = self.read_event_headers()
+            events = events[[bool(self._selection(header)) for header in headers]]
+
+        selected = np.isin(index.longitudinal_event, events)
+        data = self._read_blocks(index.longitudinal[selected])
+        block_event = np.searchsorted(events, index.longitudinal_event[selected])
+        return _stack_longitudinal(data, self.block_size, block_event, len(events))
+
+    def read_headers(self):
+        '''
+        Read the run header, all event headers and the run end,
+        without reading the data blocks. See `read_event_headers`.
+        '''
+        event_headers, _ = self.read_event_headers()
         return self.run_header, event_headers, self._run_end
 
     def __enter__(self):
@@ -208,22 +1119,55 @@ class CorsikaFile:
         self.close()
 
     def close(self):
+        if self._prefetch_thread is not None:
+            self._prefetch_stop.set()
+            self._prefetch_thread.join()
+
         self._f.close()
+        if self._raw is not None:
+            self._raw.close()
+        if self._seekable is not None:
+            self._seekable.close()
+        self._fd = None
+        if self._mmap is not None:
+            try:
+                self._mmap.close()
+            except BufferError:
+                # arrays returned to the user still reference the mapping,
+                # it will be unmapped once these are garbage collected
+                pass
 
 
 class CorsikaCherenkovFile(CorsikaFile):
+    """
+    A CORSIKA file containing cherenkov photons.
+
+    If ``columns`` is given, e.g. ``columns=('x', 'y', 't')``, the photons
+    of each event are a dict mapping only these columns to contiguous arrays
+    instead of a structured array. This requires ``parse_blocks=True``.
+    """
+    _payload_dtypes = (cherenkov_photons_dtype, cherenkov_photons_thin_dtype)
+
+    def __init__(self, path, thinning=None, mmcs=False, columns=None, **kwargs):
+        if columns is not None and not kwargs.get('parse_blocks', True):
+            raise ValueError('columns can only be selected with parse_blocks=True')
 
-    def __init__(self, path, thinning=False, mmcs=False, **kwargs):
         super().__init__(path, thinning=thinning, **kwargs)
 
         self.EventClass = PhotonEvent
         self.mmcs = mmcs
+        self.columns = columns
+
+    def _reopen_kwargs(self):
+        return dict(super()._reopen_kwargs(), mmcs=self.mmcs, columns=self.columns)
 
     def parse_data_blocks(self, data_bytes):
-        if self.thinning is False:
-            photons = parse_cherenkov_photons(data_bytes)
+        if self.mmcs:
+            columns = None
         else:
-            photons = parse_cherenkov_photons_thin(data_bytes)
+            columns = self.columns
+
+        photons = self.decoder.payload(data_bytes, columns=columns)
         if not self.mmcs:
             return photons
 
@@ -236,17 +1180,52 @@ class CorsikaCherenkovFile(CorsikaFile):
         mmcs['wavelength'] = photons['n_photons'] % 1000
         mmcs['mother_particle'] = photons['n_photons'] // 100000
 
-        return mmcs
+        if self.columns is None:
+            return mmcs
+
+        unknown = set(self.columns) - set(mmcs.dtype.names)
+        if unknown:
+            raise ValueError(f"Unknown columns {sorted(unknown)}, available: {mmcs.dtype.names}")
+        return {name: np.ascontiguousarray(mmcs[name]) for name in self.columns}
 
 
 class CorsikaParticleFile(CorsikaFile):
+    """
+    A CORSIKA file containing particles.
+
+    If ``columns`` is given, e.g. ``columns=('x', 'y', 't')``, the particles
+    of each event are a dict mapping only these columns to contiguous arrays
+    instead of a structured array. This requires ``parse_blocks=True``.
+
+    If ``auxiliary`` is True, the additional records written with the
+    MUADDI or EHISTORY options are removed from the particles of each event
+    and stored in ``event.auxiliary`` together with the index of the particle
+    they belong to, see `corsikaio.particles.split_auxiliary`.
+    This applies to events, not to `iter_batches` and `iter_chunked`.
+    """
+    _payload_dtypes = (particle_data_dtype, particle_data_thin_dtype)
+
+    def __init__(self, path, thinning=None, columns=None, auxiliary=False, **kwargs):
+        if columns is not None and not kwargs.get('parse_blocks', True):
+            raise ValueError('columns can only be selected with parse_blocks=True')
 
-    def __init__(self, path, thinning=False, **kwargs):
         super().__init__(path, thinning=thinning, **kwargs)
         self.EventClass = ParticleEvent
+        self.columns = columns
+        self.auxiliary = auxiliary
+
+    def _reopen_kwargs(self):
+        return dict(super()._reopen_kwargs(), columns=self.columns, auxiliary=self.auxiliary)
+
+    def _parse_event(self, *args, **kwargs):
+        event = super()._parse_event(*args, **kwargs)
+        if not self.auxiliary:
+            return event
+
+        particles, auxiliary = split_auxiliary(event.particles)
+        event = event._replace(particles=particles)
+        event.auxiliary = auxiliary
+        return event
 
     def parse_data_blocks(self, data_bytes):
-        if self.thinning is False:
-            return parse_particle_data(data_bytes)
-        else:
-            return parse_particle_data_thin(data_bytes)
+        return self.decoder.payload(data_bytes, columns=self.columns)
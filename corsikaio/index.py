@@ -0,0 +1,334 @@
+"""
+Index of the byte offsets of events in CORSIKA binary files, used for random access.
+"""
+import os
+from pathlib import Path
+
+import numpy as np
+
+from .constants import BLOCK_SIZE_BYTES, BLOCK_SIZE_BYTES_THIN, EVTH_VERSION_POSITION
+
+
+#: suffix appended to the name of a CORSIKA file to get the path of its index file
+INDEX_SUFFIX = '.index.npz'
+
+
+def index_path(path):
+    '''Path of the sidecar index file for the CORSIKA file at ``path``'''
+    path = Path(path)
+    return path.with_name(path.name + INDEX_SUFFIX)
+
+
+def _block_words(data, block_size, position, dtype):
+    '''View the 4-byte word at ``position`` (1-based, as in the CORSIKA manual) of each block in ``data``'''
+    n_blocks = len(data) // block_size
+    return np.ndarray(
+        n_blocks,
+        dtype=dtype,
+        buffer=data,
+        offset=4 * (position - 1),
+        strides=(block_size, ),
+    )
+
+
+def find_blocks(data, marker, block_size):
+    '''Indices of the blocks in ``data`` starting with ``marker``, e.g. ``b'RUNE'``'''
+    return np.flatnonzero(_block_words(data, block_size, 1, 'S4') == marker)
+
+
+class EventIndex:
+    '''
+    Byte offsets of the blocks of the events in a CORSIKA file.
+
+    All offsets are positions in the uncompressed file,
+    including the fortran record markers if present.
+
+    Attributes
+    ----------
+    block_size: int
+        Size of a block in bytes
+    record_offsets: np.ndarray
+        Position of the data of each fortran record (after the record marker).
+        Files without record markers consist of a single record.
+    record_sizes: np.ndarray
+        Size of the data of each fortran record in bytes
+    event_header: np.ndarray
+        Position of the EVTH block of each event
+    event_end: np.ndarray
+        Position of the EVTE block of each event
+    event_number: np.ndarray
+        Event number of each event as stored in the EVTH block
+    longitudinal: np.ndarray
+        Position of each LONG block
+    longitudinal_event: np.ndarray
+        Index of the event each LONG block belongs to
+    run_end: int
+        Position of the RUNE block, -1 if not found
+    '''
+    _arrays = (
+        'record_offsets',
+        'record_sizes',
+        'event_header',
+        'event_end',
+        'event_number',
+        'longitudinal',
+        'longitudinal_event',
+    )
+
+    def __init__(
+        self,
+        block_size,
+        record_offsets,
+        record_sizes,
+        event_header,
+        event_end,
+        event_number,
+        longitudinal,
+        longitudinal_event,
+        run_end=-1,
+    ):
+        self.block_size = int(block_size)
+        self.record_offsets = np.asarray(record_offsets, dtype=np.int64)
+        self.record_sizes = np.asarray(record_sizes, dtype=np.int64)
+        self.event_header = np.asarray(event_header, dtype=np.int64)
+        self.event_end = np.asarray(event_end, dtype=np.int64)
+        self.event_number = np.asarray(event_number, dtype=np.int64)
+        self.longitudinal = np.asarray(longitudinal, dtype=np.int64)
+        self.longitudinal_event = np.asarray(longitudinal_event, dtype=np.int64)
+        self.run_end = int(run_end)
+
+    def __len__(self):
+        return len(self.event_header)
+
+    def block_offsets(self, start, stop):
+        '''Positions of all blocks in the byte range ``[start, stop)``'''
+        first = np.searchsorted(self.record_offsets, start, side='right') - 1
+        last = np.searchsorted(self.record_offsets, stop, side='left')
+
+        offsets = []
+        for offset, size in zip(self.record_offsets[first:last], self.record_sizes[first:last]):
+            lower = max(start, offset)
+            upper = min(stop, offset + size)
+            offsets.append(np.arange(lower, upper, self.block_size, dtype=np.int64))
+
+        if len(offsets) == 0:
+            return np.empty(0, dtype=np.int64)
+        return np.concatenate(offsets)
+
+    def event_blocks(self, event):
+        '''Positions of all blocks of the event with index ``event``, from EVTH to EVTE'''
+        return self.block_offsets(
+            self.event_header[event],
+            self.event_end[event] + self.block_size,
+        )
+
+    def event_longitudinal(self, event):
+        '''Positions of the LONG blocks of the event with index ``event``'''
+        start, stop = np.searchsorted(self.longitudinal_event, [event, event + 1])
+        return self.longitudinal[start:stop]
+
+    def find(self, event_number):
+        '''Index of the event with the given ``event_number``'''
+        indices = np.flatnonzero(self.event_number == event_number)
+        if len(indices) == 0:
+            raise KeyError(f'No event with event_number {event_number}')
+        return int(indices[0])
+
+    def save(self, path, source=None):
+        '''
+        Save the index to ``path``.
+
+        If ``source`` is given, size and modification time of the CORSIKA file
+        are stored, so that `load` can detect outdated index files.
+        '''
+        source_stat = [-1, -1]
+        if source is not None:
+            stat = os.stat(source)
+            source_stat = [stat.st_size, stat.st_mtime_ns]
+
+        # write to a file object, np.savez would otherwise append another suffix
+        with open(path, 'wb') as f:
+            np.savez(
+                f,
+                block_size=self.block_size,
+                run_end=self.run_end,
+                source_stat=np.array(source_stat, dtype=np.int64),
+                **{name: getattr(self, name) for name in self._arrays},
+            )
+
+    @classmethod
+    def load(cls, path, source=None):
+        '''
+        Load an index saved with `save`.
+
+        Raises a ``ValueError`` if ``source`` is given and the CORSIKA file
+        was modified after the index was created.
+        '''
+        with np.load(path) as data:
+            if source is not None:
+                stat = os.stat(source)
+                if list(data['source_stat']) != [stat.st_size, stat.st_mtime_ns]:
+                    raise ValueError(f'Index file {path} is outdated')
+
+            return cls(
+                block_size=data['block_size'],
+                run_end=data['run_end'],
+                **{name: data[name] for name in cls._arrays},
+            )
+
+
+def build_index(records, thinning=False, version=None, return_blocks=False):
+    '''
+    Build an `EventIndex` in a single pass over the records of a CORSIKA file.
+
+    Instead of looping over the blocks, each record is viewed as array
+    of 4-byte words at block stride to find the block markers in bulk.
+
+    Parameters
+    ----------
+    records: iterable
+        ``(offset, data)`` tuples as returned by `corsikaio.io.iter_records`
+        or `corsikaio.io.iter_records_mmap`
+    thinning: bool
+        Whether the file was written using thinning
+    version: float or None
+        If given, only blocks starting with EVTH that also contain this version
+        are considered event headers, protecting against data blocks that
+        start with EVTH by accident.
+    return_blocks: bool
+        If True, also return the content of the EVTH, EVTE and RUNE blocks.
+
+    Returns
+    -------
+    index: EventIndex
+    blocks: tuple
+        Only if ``return_blocks`` is True. The concatenated EVTH blocks,
+        the concatenated EVTE blocks and the RUNE block (None if not found)
+    '''
+    if thinning is False:
+        block_size = BLOCK_SIZE_BYTES
+    else:
+        block_size = BLOCK_SIZE_BYTES_THIN
+
+    record_offsets = []
+    record_sizes = []
+    headers = []
+    event_numbers = []
+    ends = []
+    longitudinal = []
+    run_ends = []
+    header_blocks = []
+    end_blocks = []
+    run_end_blocks = []
+
+    for offset, data in records:
+        record_offsets.append(offset)
+        record_sizes.append(len(data))
+
+        markers = _block_words(data, block_size, 1, 'S4')
+        block_offsets = offset + block_size * np.arange(len(markers), dtype=np.int64)
+
+        is_header = markers == b'EVTH'
+        if version is not None:
+            versions = _block_words(data, block_size, EVTH_VERSION_POSITION, np.float32)
+            is_header &= np.round(versions.astype(np.float64), 4) == version
+
+        is_end = markers == b'EVTE'
+        is_run_end = markers == b'RUNE'
+
+        headers.append(block_offsets[is_header])
+        event_numbers.append(_block_words(data, block_size, 2, np.float32)[is_header])
+        ends.append(block_offsets[is_end])
+        longitudinal.append(block_offsets[markers == b'LONG'])
+        run_ends.append(block_offsets[is_run_end])
+
+        if return_blocks:
+            blocks = np.frombuffer(data, dtype=np.uint8).reshape(-1, block_size)
+            header_blocks.append(blocks[is_header])
+            end_blocks.append(blocks[is_end])
+            run_end_blocks.append(blocks[is_run_end])
+
+    def concat(arrays, dtype=np.int64):
+        if len(arrays) == 0:
+            return np.empty(0, dtype=dtype)
+        return np.concatenate(arrays)
+
+    headers = concat(headers)
+    event_numbers = concat(event_numbers, np.float32)
+    ends = concat(ends)
+    longitudinal = concat(longitudinal)
+    run_ends = concat(run_ends)
+
+    # candidate markers inside the data of an event are not block markers,
+    # so we go from event to event, the same way the events are read
+    event_header = []
+    event_end = []
+    event_number = []
+    accepted_headers = []
+    accepted_ends = []
+    run_end = -1
+    accepted_run_end = None
+    pos = -1
+    while True:
+        next_header = np.searchsorted(headers, pos, side='right')
+        next_run_end = np.searchsorted(run_ends, pos, side='right')
+
+        if next_run_end < len(run_ends) and (
+            next_header == len(headers) or run_ends[next_run_end] < headers[next_header]
+        ):
+            run_end = run_ends[next_run_end]
+            accepted_run_end = next_run_end
+            break
+
+        if next_header == len(headers):
+            break
+
+        header = headers[next_header]
+        end = np.searchsorted(ends, header, side='right')
+        if end == len(ends):
+            raise IOError("EVTE block not found, file seems to be truncated")
+
+        event_header.append(header)
+        event_end.append(ends[end])
+        event_number.append(event_numbers[next_header])
+        accepted_headers.append(next_header)
+        accepted_ends.append(end)
+        pos = ends[end]
+
+    event_header = np.array(event_header, dtype=np.int64)
+    event_end = np.array(event_end, dtype=np.int64)
+
+    # assign longitudinal blocks to their events, dropping candidates outside of events
+    longitudinal_event = np.searchsorted(event_header, longitudinal, side='right') - 1
+    valid = longitudinal_event >= 0
+    valid[valid] &= longitudinal[valid] < event_end[longitudinal_event[valid]]
+
+    index = EventIndex(
+        block_size=block_size,
+        record_offsets=record_offsets,
+        record_sizes=record_sizes,
+        event_header=event_header,
+        event_end=event_end,
+        event_number=event_number,
+        longitudinal=longitudinal[valid],
+        longitudinal_event=longitudinal_event[valid],
+        run_end=run_end,
+    )
+
+    if not return_blocks:
+        return index
+
+    def select(blocks, selected):
+        blocks = concat(blocks, np.uint8).reshape(-1, block_size)
+        return blocks[np.asarray(selected, dtype=np.int64)].tobytes()
+
+    run_end_block = None
+    if accepted_run_end is not None:
+        run_end_block = select(run_end_blocks, [accepted_run_end])
+
+    blocks = (
+        select(header_blocks, accepted_headers),
+        select(end_blocks, accepted_ends),
+        run_end_block,
+    )
+    return index, blocks
@@ -1,6 +1,12 @@
-import gzip
+import io
+import mmap
+import os
+import stat
 import struct
+import zlib
+from collections import namedtuple
 
+from .backends import detect_compression, open_decompressed
 from .constants import BLOCK_SIZE_BYTES, BLOCK_SIZE_BYTES_THIN
 
 
@@ -11,6 +17,182 @@ DEFAULT_BUFFER_SIZE_THIN = BLOCK_SIZE_BYTES_THIN * 100
 RECORD_MARKER = struct.Struct('i')
 
 
+#: magic bytes at the start of compressed files
+GZIP_MAGIC = b'\x1f\x8b'
+ZSTD_MAGIC = b'\x28\xb5\x2f\xfd'
+
+#: number of bytes needed to detect the compression
+MAGIC_SIZE = 8
+#: number of uncompressed bytes needed to detect the layout of a file:
+#: record marker and the first two blocks
+PROBE_SIZE = RECORD_MARKER.size + 2 * BLOCK_SIZE_BYTES_THIN
+#: size of the reads of the compressed data while probing
+PROBE_READ_SIZE = 64 * 1024
+
+#: Compression, fortran record size (None for files without record markers)
+#: and thinning of a CORSIKA file, see `probe`
+FileLayout = namedtuple('FileLayout', ['compression', 'buffer_size', 'thinning'])
+
+
+class PrefixedReader(io.RawIOBase):
+    '''
+    Raw stream returning ``prefix`` followed by the remaining content of ``f``.
+
+    Used to put back bytes that were already read from a stream that cannot seek.
+    Closing this stream only closes ``f`` if ``close_source`` is True.
+    '''
+
+    def __init__(self, prefix, f, close_source=False):
+        self._prefix = bytes(prefix)
+        self._f = f
+        self._close_source = close_source
+
+    def close(self):
+        if self._close_source and not self.closed:
+            self._f.close()
+        super().close()
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        if self._prefix:
+            n = min(len(buffer), len(self._prefix))
+            buffer[:n] = self._prefix[:n]
+            self._prefix = self._prefix[n:]
+            return n
+
+        data = self._f.read(len(buffer))
+        n = len(data)
+        buffer[:n] = data
+        return n
+
+
+def read_exactly(f, size):
+    '''Read ``size`` bytes from ``f``, unless the end of the stream is reached first'''
+    data = f.read(size)
+    while 0 < len(data) < size:
+        chunk = f.read(size - len(data))
+        if not chunk:
+            break
+        data += chunk
+    return data
+
+
+def wrap_compressed(f, compression, backend=None):
+    '''
+    Decompressing reader for the raw binary file object ``f``,
+    see `corsikaio.backends` for the choice of the ``backend``.
+    '''
+    if compression is None:
+        return f
+    return open_decompressed(f, compression, backend)
+
+
+def detect_layout(data, compression=None):
+    '''
+    Detect record markers and thinning from the first uncompressed bytes of a file.
+
+    Thinning is detected from the position of the block following RUNH,
+    which is either EVTH or RUNE. If that is not conclusive, the size of
+    the fortran records is used, which is a multiple of the block size.
+    '''
+    buffer_size = None
+    start = 0
+    if data[:4] != b'RUNH' and len(data) >= RECORD_MARKER.size:
+        buffer_size, = RECORD_MARKER.unpack(data[:RECORD_MARKER.size])
+        start = RECORD_MARKER.size
+
+    for thinning, block_size in ((False, BLOCK_SIZE_BYTES), (True, BLOCK_SIZE_BYTES_THIN)):
+        marker = data[start + block_size:start + block_size + 4]
+        if marker in (b'EVTH', b'RUNE'):
+            return FileLayout(compression, buffer_size, thinning)
+
+    thinning = (
+        buffer_size is not None
+        and buffer_size % BLOCK_SIZE_BYTES != 0
+        and buffer_size % BLOCK_SIZE_BYTES_THIN == 0
+    )
+    return FileLayout(compression, buffer_size, thinning)
+
+
+def read_head(f, compression, size=PROBE_SIZE):
+    '''
+    Read the first ``size`` uncompressed bytes of the raw, seekable file object ``f``
+    and seek back to the start.
+
+    Compressed data is only decompressed as far as needed.
+    '''
+    if compression == 'gzip':
+        decompressor = zlib.decompressobj(wbits=31)
+        data = b''
+        while len(data) < size and not decompressor.eof:
+            chunk = decompressor.unconsumed_tail or f.read(PROBE_READ_SIZE)
+            if not chunk:
+                break
+            data += decompressor.decompress(chunk, size - len(data))
+    elif compression is not None:
+        # backends do not close file objects passed to them, so the stream is just dropped
+        data = read_exactly(open_decompressed(f, compression), size)
+    else:
+        data = read_exactly(f, size)
+
+    f.seek(0)
+    return data
+
+
+def probe(f):
+    '''
+    Detect the `FileLayout` of the raw, seekable binary file object ``f``
+    with a single read of its first bytes. The position of ``f`` is reset to the start.
+    '''
+    compression = detect_compression(f.read(MAGIC_SIZE))
+    f.seek(0)
+    return detect_layout(read_head(f, compression), compression)
+
+
+def probe_stream(f):
+    '''
+    Open a readable binary file-like object, e.g. a pipe or ``sys.stdin.buffer``,
+    and detect its `FileLayout`.
+
+    Everything is detected from the first bytes without seeking,
+    so this also works for streams that are not seekable.
+
+    Returns
+    -------
+    stream:
+        Reader for the decompressed content of ``f``,
+        closing it does not close ``f``.
+    layout: FileLayout
+    '''
+    head = read_exactly(f, MAGIC_SIZE)
+    compression = detect_compression(head)
+    stream = wrap_compressed(io.BufferedReader(PrefixedReader(head, f)), compression)
+
+    data = read_exactly(stream, PROBE_SIZE)
+    stream = io.BufferedReader(PrefixedReader(data, stream, close_source=True))
+    return stream, detect_layout(data, compression)
+
+
+def open_stream(f):
+    '''
+    Open a readable binary file-like object, e.g. a pipe or ``sys.stdin.buffer``,
+    detecting the compression without seeking. See `probe_stream`.
+    '''
+    return probe_stream(f)[0]
+
+
+def is_stream(path):
+    '''
+    Test if ``path`` has to be read as a stream, i.e. it is a file-like object
+    or it does not refer to a regular file, e.g. a named pipe or ``/dev/stdin``.
+    '''
+    if hasattr(path, 'read'):
+        return True
+    return not stat.S_ISREG(os.stat(path).st_mode)
+
+
 def is_gzip(path):
     '''Test if a file is gzipped by reading its first two bytes and compare
     to the gzip marker bytes.
@@ -18,7 +200,7 @@ def is_gzip(path):
     with open(path, 'rb') as f:
         marker_bytes = f.read(2)
 
-    return marker_bytes[0] == 0x1f and marker_bytes[1] == 0x8b
+    return marker_bytes[:2] == GZIP_MAGIC
 
 
 def is_zstd(path):
@@ -27,18 +209,30 @@ def is_zstd(path):
     with open(path, 'rb') as f:
         marker_bytes = f.read(4)
 
-    return marker_bytes == b'\x28\xb5\x2f\xfd'
+    return marker_bytes == ZSTD_MAGIC
+
 
+def open_compressed(path, layout=None, backend=None):
+    '''
+    Open a possibly compressed file for reading, e.g. using gzip or zstd,
+    see `corsikaio.backends` for the supported formats and the choice of ``backend``.
 
-def open_compressed(path):
-    if is_gzip(path):
-        return gzip.open(path)
+    ``path`` can also be a readable binary file-like object, see `open_stream`.
+    If the `FileLayout` of the file is already known, pass it as ``layout``
+    to skip detecting the compression again.
+    '''
+    if hasattr(path, 'read'):
+        return open_stream(path)
 
-    if is_zstd(path):
-        from zstandard import ZstdDecompressor
-        return ZstdDecompressor().stream_reader(open(path, 'rb'))
+    if layout is not None:
+        compression = layout.compression
+    else:
+        with open(path, 'rb') as f:
+            compression = detect_compression(f.read(MAGIC_SIZE))
 
-    return open(path, 'rb')
+    if compression is None:
+        return open(path, 'rb')
+    return open_decompressed(path, compression, backend)
 
 
 def read_buffer_size(path):
@@ -48,18 +242,18 @@ def read_buffer_size(path):
     if not interpret it as unsigned integer, the
     size of the CORSIKA buffer in bytes
     '''
-    with open_compressed(path) as f:
-        data = f.read(RECORD_MARKER.size)
-
-        if data == b'RUNH':
-            return None
-
-        buffer_size, = RECORD_MARKER.unpack(data)
+    with open(path, 'rb') as f:
+        return probe(f).buffer_size
 
-    return buffer_size
 
+def iter_records(f, thinning=False):
+    '''
+    Iterate over the records of a CORSIKA file as ``(offset, data)`` tuples.
 
-def iter_blocks(f, thinning=False):
+    ``offset`` is the position of ``data`` in the (uncompressed) file,
+    the fortran record markers are not part of ``data``.
+    For files without record markers, chunks of `DEFAULT_BUFFER_SIZE` are returned.
+    '''
     is_fortran_file = True
     if thinning == False:
         block_size = BLOCK_SIZE_BYTES
@@ -69,15 +263,21 @@ def iter_blocks(f, thinning=False):
         buffer_size = DEFAULT_BUFFER_SIZE_THIN
 
 
-    data = f.read(4)
-    f.seek(0)
-    if data == b'RUNH':
+    # the first bytes are kept instead of seeking back,
+    # as not all streams support seeking backwards
+    first = f.read(RECORD_MARKER.size)
+    if first == b'RUNH':
         is_fortran_file = False
 
+    pos = 0
     while True:
         # for the fortran-chunked output, we need to read the record size
         if is_fortran_file:
-            data = f.read(RECORD_MARKER.size)
+            if first is not None:
+                data, first = first, None
+            else:
+                data = f.read(RECORD_MARKER.size)
+
             if len(data) == 0:
                 return
 
@@ -85,8 +285,13 @@ def iter_blocks(f, thinning=False):
                 raise IOError("Read less bytes than expected, file seems to be truncated")
 
             buffer_size, = RECORD_MARKER.unpack(data)
-
-        data = f.read(buffer_size)
+            pos += RECORD_MARKER.size
+            data = f.read(buffer_size)
+        elif first is not None:
+            data = first + f.read(buffer_size - len(first))
+            first = None
+        else:
+            data = f.read(buffer_size)
         if is_fortran_file:
             if len(data) < buffer_size:
                 raise IOError("Read less bytes than expected, file seems to be truncated")
@@ -95,19 +300,110 @@ def iter_blocks(f, thinning=False):
             if len(data) == 0:
                 return
 
-        n_blocks, rest = divmod(len(data), block_size)
-        if rest != 0:
+        if len(data) % block_size != 0:
             raise IOError("Read less bytes than expected, file seems to be truncated")
 
-        for block in range(n_blocks):
-            start = block * block_size
-            stop = start + block_size
-            block = data[start:stop]
-            yield block
+        yield pos, data
+        pos += len(data)
 
         # read trailing record marker
         if is_fortran_file:
             f.read(RECORD_MARKER.size)
+            pos += RECORD_MARKER.size
+
+
+def iter_blocks(f, thinning=False):
+    if thinning == False:
+        block_size = BLOCK_SIZE_BYTES
+    else:
+        block_size = BLOCK_SIZE_BYTES_THIN
+
+    for _, data in iter_records(f, thinning=thinning):
+        for start in range(0, len(data), block_size):
+            yield data[start:start + block_size]
+
+
+def open_mmap(path):
+    '''
+    Memory map an uncompressed file for reading.
+
+    Returns None if the file is compressed with any registered compression,
+    see `corsikaio.backends.detect_compression`, or cannot be memory mapped,
+    e.g. because it is empty.
+    '''
+    with open(path, 'rb') as f:
+        if detect_compression(f.read(MAGIC_SIZE)) is not None:
+            return None
+        return map_file(f)
+
+
+def map_file(f):
+    '''Memory map the open, uncompressed file ``f``, returns None if not possible'''
+    try:
+        return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    except (OSError, ValueError):
+        return None
+
+
+def iter_records_mmap(buffer, thinning=False):
+    '''
+    Iterate over the records of an uncompressed CORSIKA file in ``buffer``,
+    e.g. the result of `open_mmap`, as ``(offset, data)`` tuples.
+
+    Like `iter_records`, but ``data`` is a ``memoryview`` into ``buffer``.
+    For files without record markers, the whole file is a single record.
+    '''
+    if thinning == False:
+        block_size = BLOCK_SIZE_BYTES
+    else:
+        block_size = BLOCK_SIZE_BYTES_THIN
+
+    view = memoryview(buffer)
+    size = len(view)
+    is_fortran_file = view[:4] != b'RUNH'
+    pos = 0
+
+    while pos < size:
+        if is_fortran_file:
+            if size - pos < RECORD_MARKER.size:
+                raise IOError("Read less bytes than expected, file seems to be truncated")
+
+            buffer_size, = RECORD_MARKER.unpack_from(view, pos)
+            pos += RECORD_MARKER.size
+        else:
+            buffer_size = size - pos
+
+        stop = pos + buffer_size
+        if stop > size:
+            raise IOError("Read less bytes than expected, file seems to be truncated")
+
+        if buffer_size % block_size != 0:
+            raise IOError("Read less bytes than expected, file seems to be truncated")
+
+        yield pos, view[pos:stop]
+
+        pos = stop
+        # skip trailing record marker
+        if is_fortran_file:
+            pos += RECORD_MARKER.size
+
+
+def iter_blocks_mmap(buffer, thinning=False):
+    '''
+    Iterate over the blocks of an uncompressed CORSIKA file in ``buffer``,
+    e.g. the result of `open_mmap`.
+
+    In contrast to `iter_blocks`, no data is copied, the blocks
+    are yielded as ``memoryview`` into ``buffer``.
+    '''
+    if thinning == False:
+        block_size = BLOCK_SIZE_BYTES
+    else:
+        block_size = BLOCK_SIZE_BYTES_THIN
+
+    for _, data in iter_records_mmap(buffer, thinning=thinning):
+        for start in range(0, len(data), block_size):
+            yield data[start:start + block_size]
 
 
 def read_block(f, thinning=False, buffer_size=None):
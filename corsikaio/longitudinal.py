@@ -1,12 +1,24 @@
 """
 Functions related to the CORSIKA longitudinal distribution
 """
+import io
+import mmap
 import re
+from collections import namedtuple
+
 import numpy as np
 
 PARTICLE_HEADER_RE = re.compile(r"LONGITUDINAL DISTRIBUTION IN\s+(\d+)\s+(SLANT|VERTICAL)\s+STEPS OF\s+(\d+(?:.\d*)?) G\/CM\*\*2 FOR SHOWER\s+(\d+)")
 ENERGY_HEADER_RE = re.compile(r"LONGITUDINAL ENERGY DEPOSIT IN\s+(\d+)\s+(SLANT|VERTICAL)\s+STEPS OF\s+(\d+(?:.\d*)?) G\/CM\*\*2 FOR SHOWER\s+(\d+)")
 
+# the same patterns for searching the whole file at once
+_PARTICLE_HEADER_BYTES_RE = re.compile(PARTICLE_HEADER_RE.pattern.encode())
+_ENERGY_HEADER_BYTES_RE = re.compile(ENERGY_HEADER_RE.pattern.encode())
+_FIT_HEADER_RE = re.compile(rb"FIT OF THE HILLAS CURVE")
+_FIT_RE = re.compile(
+    rb"PARAMETERS\s*=(.*)\n\s*CHI\*\*2/DOF\s*=(.*)\n\s*AV\. DEVIATION IN % =(.*)"
+)
+
 ENERGY_COLUMNS = [
     "depth",
     "gamma", "em_ioniz", "em_cut", "mu_ioniz",
@@ -38,11 +50,413 @@ def longitudinal_fit_function(depth, n_max, depth_0, depth_max, a, b, c):
     return n_max * power *  exp
 
 
+def evaluate_longitudinal_fit(depth, parameters):
+    """
+    Evaluate `longitudinal_fit_function` for many parameter sets at once.
+
+    Parameters
+    ----------
+    depth : np.ndarray
+        Depths, shape ``(n_depths, )`` to use the same depths for all
+        parameter sets or ``(n, n_depths)``
+    parameters : np.ndarray
+        Parameter sets of shape ``(n, 6)`` in the layout of
+        ``event.end["longitudinal_fit_parameters"]``
+
+    Returns
+    -------
+    values : np.ndarray
+        Array of shape ``(n, n_depths)``
+    """
+    parameters = np.asarray(parameters, dtype=np.float64)
+    # one (n, 1) array per parameter, broadcasting against the depths
+    return longitudinal_fit_function(np.asarray(depth), *np.moveaxis(parameters[..., np.newaxis], -2, 0))
+
+
+#: number of profiles fitted together, limits the size of the jacobian
+FIT_CHUNK_SIZE = 4096
+
+
+def _fit_model(depth, parameters):
+    """
+    The fit function and its derivatives with respect to the parameters.
+
+    Depths below ``depth_0`` evaluate to 0, returns NaN for invalid parameters.
+    """
+    n_max, depth_0, depth_max, a, b, c = parameters[..., np.newaxis].swapaxes(0, 1)
+    denominator = a + b * depth + c * depth**2
+    exponent = (depth_max - depth_0) / denominator
+
+    valid = depth > depth_0
+    with np.errstate(divide='ignore', invalid='ignore', over='ignore'):
+        distance = np.where(valid, depth - depth_0, 1.0)
+        log_ratio = np.log(distance) - np.log(depth_max - depth_0)
+        log_value = np.log(n_max) + exponent * log_ratio + (depth_max - depth) / denominator
+        value = np.where(valid, np.exp(log_value), 0.0)
+
+        # derivatives of log(value)
+        d_depth_0 = -log_ratio / denominator + exponent * (1 / (depth_max - depth_0) - 1 / distance)
+        d_depth_max = (log_ratio + 1) / denominator - exponent / (depth_max - depth_0)
+        d_denominator = -(exponent * log_ratio + (depth_max - depth) / denominator) / denominator
+
+        jacobian = value[..., np.newaxis] * np.stack([
+            np.broadcast_to(1 / n_max, value.shape),
+            d_depth_0,
+            d_depth_max,
+            d_denominator,
+            d_denominator * depth,
+            d_denominator * depth**2,
+        ], axis=-1)
+
+    invalid = (n_max <= 0) | (depth_max <= depth_0) | np.any(valid & (denominator <= 0), axis=-1, keepdims=True)
+    value = np.where(invalid, np.nan, value)
+    return value, np.where(valid[..., np.newaxis], jacobian, 0.0)
+
+
+def _fit_chunk(depth, counts, max_iterations, tolerance):
+    """Levenberg-Marquardt fit of all profiles in ``counts`` at once"""
+    n_profiles = len(counts)
+    depth = np.broadcast_to(depth, counts.shape)
+
+    # poisson uncertainties, bins without particles are not used
+    used = np.isfinite(counts) & (counts > 0)
+    counts = np.where(used, counts, 0.0)
+    weight = np.where(used, 1 / np.sqrt(np.where(used, counts, 1.0)), 0.0)
+
+    # start from the maximum of the profile
+    peak = np.argmax(counts, axis=-1)
+    n_max = counts[np.arange(n_profiles), peak]
+    depth_max = depth[np.arange(n_profiles), peak]
+    parameters = np.zeros((n_profiles, 6))
+    parameters[:, 0] = n_max
+    parameters[:, 1] = np.minimum(0.0, depth_max - 100.0)
+    parameters[:, 2] = depth_max
+    parameters[:, 3] = 70.0
+
+    def chi2(parameters, rows=slice(None)):
+        value, jacobian = _fit_model(depth[rows], parameters)
+        with np.errstate(invalid='ignore', over='ignore'):
+            residual = (counts[rows] - value) * weight[rows]
+            result = np.sum(residual**2, axis=-1)
+            jacobian = jacobian * weight[rows, :, np.newaxis]
+        # unused bins may be infinite for the fit function, they do not contribute
+        jacobian = np.where(used[rows, :, np.newaxis], jacobian, 0.0)
+        return np.where(np.isfinite(result), result, np.inf), residual, jacobian
+
+    current, residual, jacobian = chi2(parameters)
+    damping = np.full(n_profiles, 1e-3)
+    active = np.isfinite(current) & (used.sum(axis=-1) > 6)
+
+    for _ in range(max_iterations):
+        if not np.any(active):
+            break
+
+        rows = np.flatnonzero(active)
+        j = jacobian[rows]
+        hessian = j.swapaxes(1, 2) @ j
+        gradient = (j.swapaxes(1, 2) @ residual[rows, :, np.newaxis])[..., 0]
+
+        # scale the parameters to a common range, then damp
+        scale = np.sqrt(np.diagonal(hessian, axis1=1, axis2=2))
+        scale = np.where(scale > 0, scale, 1.0)
+        scaled = hessian / scale[:, :, np.newaxis] / scale[:, np.newaxis, :]
+        scaled += damping[rows, np.newaxis, np.newaxis] * np.eye(6)
+        step = np.linalg.solve(scaled, (gradient / scale)[..., np.newaxis])[..., 0] / scale
+
+        candidate = parameters[rows] + step
+        new, new_residual, new_jacobian = chi2(candidate, rows)
+        improved = new < current[rows]
+
+        better = rows[improved]
+        converged = improved & (current[rows] - new <= tolerance * current[rows])
+        parameters[better] = candidate[improved]
+        current[better] = new[improved]
+        residual[better] = new_residual[improved]
+        jacobian[better] = new_jacobian[improved]
+
+        damping[rows] = np.where(improved, damping[rows] / 10, damping[rows] * 10)
+        active[rows[converged | (damping[rows] > 1e10)]] = False
+
+    n_dof = used.sum(axis=-1) - 6
+    with np.errstate(divide='ignore', invalid='ignore'):
+        chi2_ndf = np.where(n_dof > 0, current / n_dof, np.nan)
+
+    failed = ~np.isfinite(chi2_ndf)
+    parameters[failed] = np.nan
+    chi2_ndf[failed] = np.nan
+    return parameters, chi2_ndf
+
+
+def fit_longitudinal(depth, counts, max_iterations=200, tolerance=1e-6):
+    """
+    Fit `longitudinal_fit_function` to many longitudinal profiles at once.
+
+    All profiles are fitted together using a vectorized Levenberg-Marquardt
+    minimization of the chi2 with poisson uncertainties. The fit starts from the
+    maximum of each profile. Bins without particles, e.g. below the ground,
+    and NaN bins, e.g. padding of `LongitudinalFile.read_all`, are not used.
+
+    >>> showers = LongitudinalFile(path).read_all()
+    >>> parameters, chi2_ndf = fit_longitudinal(showers.particles["depth"], showers.particles["charged"])
+
+    Parameters
+    ----------
+    depth : np.ndarray
+        Depths of the bins, shape ``(n_depths, )`` or ``(n_profiles, n_depths)``
+    counts : np.ndarray
+        Number of particles, e.g. charged particles, shape ``(n_profiles, n_depths)``
+    max_iterations : int
+        Maximum number of iterations
+    tolerance : float
+        The fit of a profile stops when the chi2 improves by less than this fraction
+
+    Returns
+    -------
+    parameters : np.ndarray
+        Fit parameters of shape ``(n_profiles, 6)``, in the layout of
+        ``event.end["longitudinal_fit_parameters"]``. NaN for failed fits.
+    chi2_ndf : np.ndarray
+        Chi2 per degree of freedom of each fit
+    """
+    counts = np.atleast_2d(np.asarray(counts, dtype=np.float64))
+    depth = np.asarray(depth, dtype=np.float64)
+    if depth.ndim == 1:
+        depth = depth[np.newaxis, :]
+    depth = np.broadcast_to(depth, counts.shape)
+
+    parameters = np.empty((len(counts), 6))
+    chi2_ndf = np.empty(len(counts))
+    for start in range(0, len(counts), FIT_CHUNK_SIZE):
+        chunk = slice(start, start + FIT_CHUNK_SIZE)
+        parameters[chunk], chi2_ndf[chunk] = _fit_chunk(
+            depth[chunk], counts[chunk], max_iterations, tolerance,
+        )
+    return parameters, chi2_ndf
+
+
+#: Longitudinal distributions of all showers of a file, stacked into arrays
+#: with one row per shower, see `LongitudinalFile.read_all`
+LongitudinalShowers = namedtuple(
+    'LongitudinalShowers',
+    ['shower', 'n_steps', 'slant', 'step_width', 'particles', 'energy_deposition', 'fit'],
+)
+
+#: dtype of the table of fit parameters, NaN for showers without fit
+fit_dtype = np.dtype([
+    ('parameters', np.float64, (6, )),
+    ('chi2_ndf', np.float64),
+    ('average_deviation', np.float64),
+])
+
+
+def _line_end(data, pos):
+    '''Position after the end of the line containing ``pos``'''
+    end = data.find(b'\n', pos)
+    return len(data) if end == -1 else end + 1
+
+
+def _parse_tables(data, spans, n_steps, columns):
+    '''Parse the numeric tables in the byte ranges ``spans`` of ``data`` in one go'''
+    text = b'\n'.join([data[start:stop] for start, stop in spans])
+    try:
+        values = np.loadtxt(io.BytesIO(text), dtype=np.float64, ndmin=2)
+    except ValueError:
+        raise IOError('Error reading file, unexpected content in longitudinal tables')
+
+    if values.size != np.sum(n_steps) * len(columns):
+        raise IOError('Error reading file, unexpected content in longitudinal tables')
+    return values.reshape(-1, len(columns))
+
+
+def _stack(rows, n_steps, columns):
+    '''Stack the rows of all tables into a structured array of shape (n_showers, n_steps)'''
+    dtype = np.dtype([(column, np.float64) for column in columns])
+    max_steps = int(np.max(n_steps, initial=0))
+
+    if np.all(n_steps == max_steps):
+        return rows.view(dtype).reshape(len(n_steps), max_steps)
+
+    # pad showers with fewer steps with NaN
+    stacked = np.full((len(n_steps), max_steps, len(columns)), np.nan)
+    stacked[np.arange(max_steps) < n_steps[:, np.newaxis]] = rows
+    return stacked.view(dtype)[..., 0]
+
+
+class LongitudinalFile:
+    """
+    A CORSIKA longitudinal file (DATXXXXXX.long) with an index of its showers.
+
+    The file is memory mapped and all header lines are found in a single pass
+    when it is opened. Tables are only parsed when read, either one shower
+    at a time using `read_shower` or all showers at once using `read_all`.
+
+    Attributes
+    ----------
+    shower: np.ndarray
+        Shower number of each shower
+    offsets: np.ndarray
+        Byte offset of each shower in the file
+    n_steps: np.ndarray
+        Number of depth steps of each shower
+    slant: np.ndarray
+        Whether the depth steps of each shower are slant depths
+    step_width: np.ndarray
+        Width of the depth steps in g/cm²
+    fit: np.ndarray
+        Fit parameters, chi2_ndf and average deviation of each shower,
+        NaN for showers without fit
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._file = open(path, 'rb')
+        try:
+            self._index()
+        except Exception:
+            self.close()
+            raise
+
+    def _index(self):
+        self._mmap = None
+        self._data = b''
+        if self._file.seek(0, 2) > 0:
+            self._mmap = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+            self._data = self._mmap
+        data = self._data
+
+        particle_headers = list(_PARTICLE_HEADER_BYTES_RE.finditer(data))
+        energy_headers = list(_ENERGY_HEADER_BYTES_RE.finditer(data))
+
+        if len(data) > 0 and (len(particle_headers) == 0 or data[:particle_headers[0].start()].strip()):
+            raise IOError(f"Inputfile {self.path} does not seem to be a longitudinal file")
+
+        if len(energy_headers) != len(particle_headers):
+            raise IOError("Error reading file, expected an energy deposition table for each shower")
+
+        self.offsets = np.array([m.start() for m in particle_headers], dtype=np.int64)
+        self.shower = np.array([int(m.group(4)) for m in particle_headers], dtype=np.int64)
+        self.n_steps = np.array([int(m.group(1)) for m in particle_headers], dtype=np.int64)
+        self.slant = np.array([m.group(2) == b'SLANT' for m in particle_headers], dtype=bool)
+        self.step_width = np.array([float(m.group(3)) for m in particle_headers])
+        self._energy_n_steps = np.array([int(m.group(1)) for m in energy_headers], dtype=np.int64)
+
+        energy_offsets = np.array([m.start() for m in energy_headers], dtype=np.int64)
+        if np.any(energy_offsets < self.offsets) or np.any(energy_offsets[:-1] > self.offsets[1:]):
+            raise IOError("Error reading file, expected an energy deposition table for each shower")
+
+        # each table ends where the next header line starts
+        fit_offsets = [m.start() for m in _FIT_HEADER_RE.finditer(data)]
+        markers = np.sort(np.concatenate([
+            self.offsets, energy_offsets, np.array(fit_offsets, dtype=np.int64), [len(data)],
+        ]))
+
+        def table_spans(headers):
+            starts = np.array([_line_end(data, _line_end(data, m.end())) for m in headers], dtype=np.int64)
+            stops = markers[np.searchsorted(markers, starts)]
+            return np.stack([starts, stops], axis=-1).reshape(-1, 2)
+
+        self._particle_spans = table_spans(particle_headers)
+        self._energy_spans = table_spans(energy_headers)
+
+        self.fit = np.full(len(self), np.nan, dtype=fit_dtype)
+        for match in _FIT_RE.finditer(data):
+            i = np.searchsorted(self.offsets, match.start(), side='right') - 1
+            self.fit[i] = (
+                [float(p) for p in match.group(1).split()],
+                float(match.group(2)),
+                float(match.group(3)),
+            )
+
+    def __len__(self):
+        return len(self.offsets)
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self[i]
+
+    def find(self, shower):
+        '''Position of the shower with number ``shower`` in the file'''
+        indices = np.flatnonzero(self.shower == shower)
+        if len(indices) == 0:
+            raise KeyError(f'No shower with number {shower}')
+        return int(indices[0])
+
+    def read_shower(self, shower):
+        '''Read the shower with number ``shower``, see `__getitem__`'''
+        return self[self.find(shower)]
+
+    def __getitem__(self, i):
+        '''
+        Read the ``i``-th shower of the file.
+
+        Returns a dict in the same format as yielded by `read_longitudinal_distributions`.
+        '''
+        i = range(len(self))[i]
+        n_steps = self.n_steps[i:i + 1]
+        particles = _parse_tables(self._data, self._particle_spans[i:i + 1], n_steps, PARTICLE_COLUMNS)
+        energy_n_steps = self._energy_n_steps[i:i + 1]
+        energy = _parse_tables(self._data, self._energy_spans[i:i + 1], energy_n_steps, ENERGY_COLUMNS)
+
+        longi = dict(
+            shower=int(self.shower[i]),
+            n_steps=int(self.n_steps[i]),
+            slant=bool(self.slant[i]),
+            step_width=float(self.step_width[i]),
+            particles=_stack(particles, n_steps, PARTICLE_COLUMNS)[0],
+            energy_deposition=_stack(energy, energy_n_steps, ENERGY_COLUMNS)[0],
+        )
+
+        fit = self.fit[i]
+        if not np.isnan(fit['chi2_ndf']):
+            longi["parameters"] = fit['parameters'].copy()
+            longi["chi2_ndf"] = float(fit['chi2_ndf'])
+            longi["average_deviation"] = float(fit['average_deviation'])
+        return longi
+
+    def read_all(self):
+        '''
+        Read all showers at once.
+
+        Returns
+        -------
+        showers: LongitudinalShowers
+            ``particles`` and ``energy_deposition`` are structured arrays of
+            shape ``(n_showers, n_steps)`` with the fields `PARTICLE_COLUMNS`
+            and `ENERGY_COLUMNS`, e.g. ``showers.particles['charged']``.
+            Showers with fewer steps than others are padded with NaN.
+        '''
+        particles = _parse_tables(self._data, self._particle_spans, self.n_steps, PARTICLE_COLUMNS)
+        energy = _parse_tables(self._data, self._energy_spans, self._energy_n_steps, ENERGY_COLUMNS)
+        return LongitudinalShowers(
+            shower=self.shower,
+            n_steps=self.n_steps,
+            slant=self.slant,
+            step_width=self.step_width,
+            particles=_stack(particles, self.n_steps, PARTICLE_COLUMNS),
+            energy_deposition=_stack(energy, self._energy_n_steps, ENERGY_COLUMNS),
+            fit=self.fit,
+        )
+
+    def close(self):
+        self._data = b''
+        if getattr(self, '_mmap', None) is not None:
+            self._mmap.close()
+            self._mmap = None
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
 def read_longitudinal_distributions(path):
     """
     Read longitudinal profiles from CORSIKA longitudinal file.
 
     This function returns a generator that iterates over air showers.
+    To read all showers at once or access showers by number, use `LongitudinalFile`.
 
     Parameters
     ----------
@@ -57,58 +471,5 @@ def read_longitudinal_distributions(path):
         and the "parameters", "chi2_ndf" and "average_deviation" values of the 
         fit to the distribution if available.
     """
-    first = True
-    with open(path, "r") as f:
-        try:
-            line = f.readline().strip()
-        except UnicodeDecodeError:
-            raise IOError(f"Inputfile {path} does not seem to be a longitudinal file")
-
-        while line:
-            match = PARTICLE_HEADER_RE.match(line)
-            if not match:
-                if first:
-                    raise IOError(f"Inputfile {path} does not seem to be a longitudinal file")
-                else:
-                    raise IOError(f"Error reading file, expected header line, got: {line}")
-            first = False
-
-            n_steps = int(match.group(1))
-            longi = dict(
-                shower=int(match.group(4)),
-                n_steps=n_steps,
-                slant=match.group(2) == "SLANT",
-                step_width=float(match.group(3)),
-            )
-
-            # skip line with names
-            f.readline()
-            longi["particles"] = np.genfromtxt(
-                f, max_rows=n_steps, names=PARTICLE_COLUMNS, dtype=None
-            )
-
-            line = f.readline().strip()
-            match = ENERGY_HEADER_RE.match(line)
-            if not match:
-                raise IOError(f"Error reading file, expected energy deposition header line, got: {line}")
-            n_steps = int(match.group(1))
-
-            # skip
-            f.readline()
-            longi["energy_deposition"] = np.genfromtxt(f, max_rows=n_steps, names=ENERGY_COLUMNS, dtype=None)
-
-            line = f.readline()
-            if line.strip().startswith("FIT"):
-                f.readline()
-                parameters = f.readline().partition(" = ")[2]
-                longi["parameters"] = np.array([float(p) for p in parameters.split()])
-
-                chi2_ndf = f.readline().partition(" = ")[2]
-                longi["chi2_ndf"] = float(chi2_ndf)
-
-                deviation = f.readline().partition(" = ")[2]
-                longi["average_deviation"] = float(deviation)
-
-            f.readline()
-            yield longi
-            line = f.readline().strip()
+    with LongitudinalFile(path) as f:
+        yield from f
@@ -0,0 +1,328 @@
+"""
+Functions to read many CORSIKA files in parallel using a process pool.
+
+The functions given to `map_files` and `map_events` are sent to the worker
+processes, so they need to be picklable, e.g. defined at module level.
+"""
+import os
+from collections import namedtuple
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from glob import glob
+from multiprocessing import resource_tracker
+from multiprocessing.shared_memory import SharedMemory
+from pathlib import Path
+
+import numpy as np
+
+from .file import CorsikaFile
+
+
+__all__ = [
+    'CorsikaDataset',
+    'map_files',
+    'map_events',
+]
+
+
+#: placeholder for an array transported via shared memory
+SharedArray = namedtuple('SharedArray', ['name', 'dtype', 'shape'])
+
+
+def _expand_paths(paths):
+    '''Turn a single path, glob pattern or iterable of those into a list of paths'''
+    if isinstance(paths, (str, Path)):
+        paths = [paths]
+
+    expanded = []
+    for path in paths:
+        if any(char in str(path) for char in '*?['):
+            expanded.extend(sorted(glob(str(path))))
+        else:
+            expanded.append(path)
+    return expanded
+
+
+def _create_untracked(size):
+    '''
+    Create shared memory that is not removed when this process exits,
+    the receiving process is responsible for removing it.
+    '''
+    try:
+        return SharedMemory(create=True, size=size, track=False)
+    except TypeError:
+        # python < 3.13, the name is registered with a leading slash on POSIX
+        shm = SharedMemory(create=True, size=size)
+        if os.name == 'posix':
+            resource_tracker.unregister('/' + shm.name, 'shared_memory')
+        return shm
+
+
+def _with_attributes(new, obj, convert):
+    '''
+    Copy the instance attributes of ``obj`` to ``new``, e.g. ``ParticleEvent.auxiliary``,
+    which are not part of the namedtuple fields
+    '''
+    for key, value in getattr(obj, '__dict__', {}).items():
+        setattr(new, key, convert(value))
+    return new
+
+
+def _to_shared(obj):
+    '''Move all numpy arrays in ``obj`` into shared memory, replacing them by `SharedArray`'''
+    if isinstance(obj, np.ndarray):
+        if obj.nbytes == 0 or obj.dtype.hasobject:
+            return obj
+
+        shm = _create_untracked(obj.nbytes)
+        np.ndarray(obj.shape, dtype=obj.dtype, buffer=shm.buf)[...] = obj
+        shm.close()
+        return SharedArray(shm.name, obj.dtype, obj.shape)
+
+    if isinstance(obj, dict):
+        return {key: _to_shared(value) for key, value in obj.items()}
+    if isinstance(obj, tuple) and hasattr(obj, '_fields'):
+        return _with_attributes(type(obj)(*(_to_shared(value) for value in obj)), obj, _to_shared)
+    if isinstance(obj, (list, tuple)):
+        return type(obj)(_to_shared(value) for value in obj)
+    return obj
+
+
+def _from_shared(obj):
+    '''Inverse of `_to_shared`, copies the arrays out of shared memory and frees it'''
+    if isinstance(obj, SharedArray):
+        shm = SharedMemory(name=obj.name)
+        try:
+            return np.ndarray(obj.shape, dtype=obj.dtype, buffer=shm.buf).copy()
+        finally:
+            shm.close()
+            shm.unlink()
+
+    if isinstance(obj, dict):
+        return {key: _from_shared(value) for key, value in obj.items()}
+    if isinstance(obj, tuple) and hasattr(obj, '_fields'):
+        return _with_attributes(type(obj)(*(_from_shared(value) for value in obj)), obj, _from_shared)
+    if isinstance(obj, (list, tuple)):
+        return type(obj)(_from_shared(value) for value in obj)
+    return obj
+
+
+def _process_file(path, func, per_event, file_class, file_kwargs, shared_memory):
+    '''Worker function, apply ``func`` to the file at ``path`` or each of its events'''
+    with file_class(path, **file_kwargs) as f:
+        if per_event:
+            result = [func(event) for event in f]
+        else:
+            result = func(f)
+
+    if shared_memory:
+        return _to_shared(result)
+    return result
+
+
+def _process_shard(file_class, path, file_kwargs, index, events, func, shared_memory):
+    '''Worker function, apply ``func`` to the events at positions ``events`` of one file'''
+    with file_class(path, **file_kwargs) as f:
+        # reuse the index of the parent process instead of scanning the file again
+        f._index = index
+        result = [func(f[event]) for event in events]
+
+    if shared_memory:
+        return _to_shared(result)
+    return result
+
+
+def map_shards(f, func, workers=None, shared_memory=False):
+    '''
+    Apply ``func`` to all events of the opened CORSIKA file ``f``,
+    decoding contiguous ranges of events in parallel worker processes.
+
+    See `CorsikaFile.read_parallel`.
+    '''
+    index = f.index
+    events = np.arange(len(index))
+
+    if f._selection is not None:
+        # evaluate the selection here, as it might not be picklable
+        headers, _ = f.read_event_headers()
+        events = events[[bool(f._selection(header)) for header in headers]]
+
+    if len(events) == 0:
+        return []
+
+    # use more shards than workers for better load balancing
+    n_workers = workers or os.cpu_count() or 1
+    n_shards = min(len(events), 4 * n_workers)
+
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = [
+            pool.submit(
+                _process_shard, type(f), f._path, f._reopen_kwargs(),
+                index, shard, func, shared_memory,
+            )
+            for shard in np.array_split(events, n_shards)
+        ]
+
+        results = []
+        for future in futures:
+            result = future.result()
+            if shared_memory:
+                result = _from_shared(result)
+            results.extend(result)
+
+    return results
+
+
+def _map(paths, func, per_event, workers, ordered, file_class, shared_memory, file_kwargs):
+    paths = iter(_expand_paths(paths))
+    # only a few files are processed ahead, so that unconsumed results,
+    # e.g. in shared memory, do not pile up if the consumer is slow
+    max_pending = 2 * (workers or os.cpu_count() or 1)
+
+    pool = ProcessPoolExecutor(max_workers=workers)
+    # future -> path, in the order of submission
+    pending = {}
+
+    def submit():
+        for path in paths:
+            future = pool.submit(
+                _process_file, path, func, per_event, file_class, file_kwargs, shared_memory
+            )
+            pending[future] = path
+            return
+
+    try:
+        for _ in range(max_pending):
+            submit()
+
+        while pending:
+            if ordered:
+                future = next(iter(pending))
+            else:
+                future = next(iter(wait(pending, return_when=FIRST_COMPLETED).done))
+
+            path = pending.pop(future)
+            submit()
+
+            result = future.result()
+            if shared_memory:
+                result = _from_shared(result)
+            yield path, result
+    finally:
+        for future in pending:
+            future.cancel()
+        pool.shutdown(wait=True)
+
+        # free shared memory of results that were not consumed
+        if shared_memory:
+            for future in pending:
+                if not future.cancelled() and future.exception() is None:
+                    _from_shared(future.result())
+
+
+def map_files(
+    paths,
+    func,
+    workers=None,
+    ordered=True,
+    file_class=CorsikaFile,
+    shared_memory=False,
+    **file_kwargs,
+):
+    '''
+    Apply ``func`` to each file in ``paths`` using a pool of worker processes.
+
+    Parameters
+    ----------
+    paths: str, Path or iterable
+        Paths of the CORSIKA files, glob patterns are expanded.
+    func: callable
+        Called in the worker processes with the opened file, e.g. a `CorsikaParticleFile`.
+    workers: int or None
+        Number of worker processes, defaults to the number of CPUs.
+    ordered: bool
+        If True, results are returned in the order of ``paths``,
+        otherwise as soon as they are available.
+    file_class: type
+        Class used to open the files, e.g. `CorsikaCherenkovFile`.
+    shared_memory: bool
+        If True, numpy arrays in the results (also inside of dicts, lists and tuples)
+        are transported using shared memory instead of being pickled.
+    **file_kwargs:
+        Passed to ``file_class``
+
+    Yields
+    ------
+    path:
+        Path of the file
+    result:
+        Return value of ``func``
+    '''
+    return _map(paths, func, False, workers, ordered, file_class, shared_memory, file_kwargs)
+
+
+def map_events(
+    paths,
+    func,
+    workers=None,
+    ordered=True,
+    file_class=CorsikaFile,
+    shared_memory=False,
+    **file_kwargs,
+):
+    '''
+    Apply ``func`` to each event of each file in ``paths`` using a pool of worker processes.
+
+    Parameters are the same as for `map_files`, except that ``func``
+    is called with each event of a file.
+
+    Yields
+    ------
+    path:
+        Path of the file
+    results: list
+        Return values of ``func`` for all events of the file
+    '''
+    return _map(paths, func, True, workers, ordered, file_class, shared_memory, file_kwargs)
+
+
+class CorsikaDataset:
+    '''
+    A collection of CORSIKA files, read in parallel using a process pool.
+
+    Parameters
+    ----------
+    paths: str, Path or iterable
+        Paths of the CORSIKA files, glob patterns are expanded.
+    file_class: type
+        Class used to open the files, e.g. `CorsikaCherenkovFile`.
+    workers: int or None
+        Number of worker processes, defaults to the number of CPUs.
+    shared_memory: bool
+        Transport numpy arrays in results using shared memory, see `map_files`.
+    **file_kwargs:
+        Passed to ``file_class``
+    '''
+
+    def __init__(self, paths, file_class=CorsikaFile, workers=None, shared_memory=False, **file_kwargs):
+        self.paths = _expand_paths(paths)
+        self.file_class = file_class
+        self.workers = workers
+        self.shared_memory = shared_memory
+        self.file_kwargs = file_kwargs
+
+    def __len__(self):
+        return len(self.paths)
+
+    def map_files(self, func, ordered=True):
+        '''Apply ``func`` to each file, see `corsikaio.parallel.map_files`'''
+        return _map(
+            self.paths, func, False, self.workers, ordered,
+            self.file_class, self.shared_memory, self.file_kwargs,
+        )
+
+    def map_events(self, func, ordered=True):
+        '''Apply ``func`` to each event, see `corsikaio.parallel.map_events`'''
+        return _map(
+            self.paths, func, True, self.workers, ordered,
+            self.file_class, self.shared_memory, self.file_kwargs,
+        )
@@ -0,0 +1,163 @@
+"""
+Functions for the particle data of CORSIKA particle files.
+"""
+from collections import namedtuple
+
+import numpy as np
+
+
+__all__ = [
+    'AUXILIARY_IDS',
+    'Auxiliary',
+    'decode_particle_description',
+    'particle_descriptions',
+    'select_rows',
+    'split_auxiliary',
+    'split_by_level',
+]
+
+
+#: particle ids of the additional muon information written with MUADDI (75, 76)
+#: and EHISTORY (85, 86, 95, 96). EHISTORY mother and grandmother particles
+#: are written with negative particle ids.
+AUXILIARY_IDS = (75, 76, 85, 86, 95, 96)
+
+#: Auxiliary records of an event and the index of the particle each one belongs to,
+#: -1 for records not followed by a particle
+Auxiliary = namedtuple('Auxiliary', ['records', 'particle'])
+
+
+def particle_descriptions(particles):
+    '''
+    The ``particle_description`` column of ``particles``, which can be a structured array,
+    a dict of columns or the float32 rows returned with ``parse_blocks=False``.
+    '''
+    if isinstance(particles, dict):
+        if 'particle_description' not in particles:
+            raise ValueError('Decoding particles requires the particle_description column')
+        return particles['particle_description']
+
+    if particles.dtype.names is None:
+        return particles[:, 0]
+    return particles['particle_description']
+
+
+def decode_particle_description(description):
+    '''
+    Decode the ``particle_description`` column of the particle data.
+
+    CORSIKA packs three integers into one float, ``id * 1000 + generation * 10 + level``,
+    with the observation level 10 stored as 0.
+    The sign is kept in the particle id.
+
+    Returns
+    -------
+    particle_id: np.ndarray
+    hadronic_generation: np.ndarray
+    observation_level: np.ndarray
+        Number of the observation level, starting at 1
+    '''
+    # all values are below 2**24, so they are exact integers in float32
+    code = np.asarray(description).astype(np.int32)
+    sign = np.sign(code)
+    np.abs(code, out=code)
+
+    particle_id, rest = np.divmod(code, 1000)
+    particle_id *= sign
+    hadronic_generation, observation_level = np.divmod(rest, 10)
+    observation_level[observation_level == 0] = 10
+    return particle_id, hadronic_generation, observation_level
+
+
+def select_rows(particles, rows):
+    '''Index ``particles`` (array or dict of columns) with ``rows``'''
+    if isinstance(particles, dict):
+        return {name: column[rows] for name, column in particles.items()}
+    return particles[rows]
+
+
+def split_by_level(particles, observation_level, n_levels=None):
+    '''
+    Split ``particles`` by observation level.
+
+    The particles are sorted by level once using a stable sort, so the
+    order within each level is kept. The particles of each level are
+    views into the sorted array (or arrays for a dict of columns).
+
+    Parameters
+    ----------
+    particles: np.ndarray or dict
+        The particles of an event
+    observation_level: np.ndarray
+        Observation level of each particle, see `decode_particle_description`
+    n_levels: int or None
+        Number of observation levels, e.g. ``n_observation_levels`` from the
+        event header. If None, the highest level present is used.
+
+    Returns
+    -------
+    levels: dict
+        Mapping of level number (starting at 1) to the particles on that level,
+        empty for levels without particles.
+
+    Raises
+    ------
+    ValueError
+        If a particle is not on one of the levels, e.g. for MUADDI records
+        which are not separated using `split_auxiliary`.
+    '''
+    highest = int(observation_level.max(initial=0))
+    if n_levels is None:
+        n_levels = highest
+
+    if highest > n_levels or observation_level.min(initial=1) < 1:
+        raise ValueError(
+            f'Observation levels must be in 1..{n_levels}, got {observation_level.min()}..{highest}'
+            ', auxiliary records need to be separated first'
+        )
+
+    order = np.argsort(observation_level, kind='stable')
+    bounds = np.searchsorted(observation_level[order], np.arange(1, n_levels + 2))
+    ordered = select_rows(particles, order)
+
+    return {
+        level: select_rows(ordered, slice(bounds[level - 1], bounds[level]))
+        for level in range(1, n_levels + 1)
+    }
+
+
+def split_auxiliary(particles, particle_id=None):
+    '''
+    Separate the MUADDI and EHISTORY records from the particles.
+
+    These records are written right before the particle they belong to,
+    so each one is attached to the next regular particle.
+
+    Parameters
+    ----------
+    particles: np.ndarray or dict
+        The particles of an event including the auxiliary records
+    particle_id: np.ndarray or None
+        Decoded particle ids, see `decode_particle_description`.
+        Decoded from ``particles`` if not given.
+
+    Returns
+    -------
+    particles: np.ndarray or dict
+        The regular particles
+    auxiliary: Auxiliary
+        The auxiliary records and, for each of them, the index of the
+        regular particle it belongs to
+    '''
+    if particle_id is None:
+        particle_id, _, _ = decode_particle_description(particle_descriptions(particles))
+
+    is_auxiliary = np.isin(particle_id, AUXILIARY_IDS) | (particle_id < 0)
+    auxiliary_rows = np.flatnonzero(is_auxiliary)
+    regular_rows = np.flatnonzero(~is_auxiliary)
+
+    particle = np.searchsorted(regular_rows, auxiliary_rows)
+    particle[particle == len(regular_rows)] = -1
+
+    auxiliary = Auxiliary(select_rows(particles, auxiliary_rows), particle)
+    return select_rows(particles, regular_rows), auxiliary
@@ -0,0 +1,458 @@
+"""
+Random access to gzip and zstd compressed CORSIKA files.
+
+Reading at a position restarts the decompression at the closest checkpoint
+before it instead of at the start of the file. Checkpoints are placed at the start
+of each gzip member or zstd frame, read from the seek table of files in the zstd
+seekable format, and, for gzip, every ``spacing`` bytes of decompressed data
+as copies of the decompressor state.
+
+Member and frame starts can be saved to a file next to the compressed file,
+the copies of the zlib decompressor state can only be kept in memory.
+Use `compress_seekable` to write files where every ``frame_size`` bytes can be
+decompressed independently.
+"""
+import bisect
+import gzip
+import io
+import os
+import struct
+import threading
+import zlib
+from pathlib import Path
+
+import numpy as np
+
+from .backends import _compress_zstd, get_decompressor, open_decompressed
+from .io import GZIP_MAGIC, open_compressed, read_exactly
+
+
+__all__ = [
+    'GzipReader',
+    'StreamReader',
+    'ZstdReader',
+    'compress_seekable',
+    'open_seekable',
+    'seek_index_path',
+]
+
+
+#: default distance of checkpoints in the decompressed data
+DEFAULT_SPACING = 4 * 1024**2
+#: maximum number of checkpoints storing a decompressor state, see `GzipReader`
+MAX_STATES = 256
+#: size of the reads of compressed data
+READ_SIZE = 128 * 1024
+#: suffix appended to the name of a compressed file to get the path of its checkpoint file
+SEEK_INDEX_SUFFIX = '.seek.npz'
+
+#: magic numbers of the zstd seekable format
+SKIPPABLE_MAGIC = 0x184D2A5E
+SEEKABLE_MAGIC = 0x8F92EAB1
+SEEK_TABLE_FOOTER = struct.Struct('<IBI')
+SKIPPABLE_HEADER = struct.Struct('<II')
+
+
+def seek_index_path(path):
+    '''Path of the sidecar checkpoint file for the compressed file at ``path``'''
+    path = Path(path)
+    return path.with_name(path.name + SEEK_INDEX_SUFFIX)
+
+
+class _Cursor:
+    '''State of an ongoing decompression'''
+
+    def __init__(self, offset, raw_offset, decompressor):
+        #: position of the next decompressed byte
+        self.offset = offset
+        #: position in the compressed file of the next read
+        self.raw_offset = raw_offset
+        self.decompressor = decompressor
+        #: compressed data read but not yet decompressed
+        self.pending = b''
+        #: decompressed data not yet returned
+        self.buffer = b''
+        self.buffer_pos = 0
+
+
+class _ReaderStream(io.RawIOBase):
+    '''Sequential file-like access to the decompressed data of a `SeekableReader`'''
+
+    def __init__(self, reader):
+        self._reader = reader
+        self._pos = 0
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        data = self._reader.read(self._pos, self._pos + len(buffer))
+        n = len(data)
+        buffer[:n] = data
+        self._pos += n
+        return n
+
+
+class SeekableReader:
+    '''
+    Positional reads of the decompressed data of a compressed file.
+
+    Reads continue the previous decompression if possible, so that reading
+    sequentially or with increasing positions does not decompress anything twice.
+    Reads are serialized using a lock, so a reader can be shared between threads.
+    '''
+
+    def __init__(self, path, spacing=DEFAULT_SPACING, max_states=MAX_STATES):
+        self.path = path
+        self.spacing = spacing
+        self.max_states = max_states
+        self._n_states = 0
+        #: size of the decompressed data, None if not known yet
+        self.size = None
+
+        # checkpoints sorted by position in the decompressed data,
+        # a state of None means the start of a gzip member or zstd frame
+        self._offsets = [0]
+        self._raw_offsets = [0]
+        self._states = [None]
+
+        self._raw = open(path, 'rb')
+        self._lock = threading.Lock()
+        self._cursor = None
+
+    def __len__(self):
+        return len(self._offsets)
+
+    def read(self, start, stop):
+        '''Read the decompressed bytes from ``start`` to ``stop``'''
+        with self._lock:
+            return self._read(start, stop)
+
+    def stream(self):
+        '''File-like object reading the decompressed data from the start, recording checkpoints'''
+        return io.BufferedReader(_ReaderStream(self), buffer_size=READ_SIZE)
+
+    def _read(self, start, stop):
+        cursor = self._cursor
+        checkpoint = bisect.bisect_right(self._offsets, start) - 1
+        if cursor is None or not self._offsets[checkpoint] <= cursor.offset <= start:
+            cursor = self._restore(checkpoint)
+
+        chunks = []
+        while cursor.offset < stop:
+            boundary = (cursor.offset // self.spacing + 1) * self.spacing
+            data = self._step(cursor, min(stop, boundary) - cursor.offset)
+            if data is None:
+                self.size = cursor.offset
+                break
+
+            if cursor.offset + len(data) > start:
+                chunks.append(data[max(0, start - cursor.offset):])
+            cursor.offset += len(data)
+
+            if cursor.offset == boundary and cursor.offset > self._offsets[-1]:
+                state = self._copy_state(cursor)
+                if state is not None:
+                    self._add_checkpoint(cursor.offset, *state)
+
+        self._cursor = cursor
+        return b''.join(chunks)
+
+    def _restore(self, checkpoint):
+        state = self._states[checkpoint]
+        if state is None:
+            decompressor = self._new_decompressor()
+        else:
+            decompressor = state.copy()
+        return _Cursor(self._offsets[checkpoint], self._raw_offsets[checkpoint], decompressor)
+
+    def _add_checkpoint(self, offset, raw_offset, state=None):
+        if offset == self._offsets[-1] and state is None and self._states[-1] is not None:
+            # a member or frame start at a spacing boundary, it does not need the state
+            self._raw_offsets[-1] = raw_offset
+            self._states[-1] = None
+            self._n_states -= 1
+        elif offset > self._offsets[-1]:
+            self._offsets.append(offset)
+            self._raw_offsets.append(raw_offset)
+            self._states.append(state)
+
+            if state is not None:
+                self._n_states += 1
+                if self._n_states > self.max_states:
+                    self._thin_states()
+
+    def _thin_states(self):
+        '''Double the spacing, dropping every other checkpoint with a decompressor state'''
+        self.spacing *= 2
+        keep = [
+            i for i, (offset, state) in enumerate(zip(self._offsets, self._states))
+            if state is None or offset % self.spacing == 0
+        ]
+        self._offsets = [self._offsets[i] for i in keep]
+        self._raw_offsets = [self._raw_offsets[i] for i in keep]
+        self._states = [self._states[i] for i in keep]
+        self._n_states = sum(state is not None for state in self._states)
+
+    def _read_raw(self, cursor):
+        '''Read the next chunk of compressed data into ``cursor.pending``'''
+        self._raw.seek(cursor.raw_offset)
+        data = self._raw.read(READ_SIZE)
+        cursor.raw_offset += len(data)
+        cursor.pending += data
+        return len(data) > 0
+
+    def _copy_state(self, cursor):
+        '''Checkpoint at the current position of ``cursor``, None if not possible'''
+        return None
+
+    def save(self, path, source=None):
+        '''
+        Save the member or frame starts to ``path``.
+
+        If ``source`` is given, size and modification time of the compressed file
+        are stored, so that `load` can detect outdated files.
+        '''
+        source_stat = [-1, -1]
+        if source is not None:
+            stat = os.stat(source)
+            source_stat = [stat.st_size, stat.st_mtime_ns]
+
+        persistent = np.array([state is None for state in self._states])
+        with open(path, 'wb') as f:
+            np.savez(
+                f,
+                offsets=np.array(self._offsets, dtype=np.int64)[persistent],
+                raw_offsets=np.array(self._raw_offsets, dtype=np.int64)[persistent],
+                size=-1 if self.size is None else self.size,
+                source_stat=np.array(source_stat, dtype=np.int64),
+            )
+
+    def load(self, path, source=None):
+        '''
+        Load checkpoints saved with `save`, if they extend the known checkpoints.
+
+        Raises a ``ValueError`` if ``source`` is given and the compressed file
+        was modified after the checkpoints were saved.
+        '''
+        with np.load(path) as data:
+            if source is not None:
+                stat = os.stat(source)
+                if list(data['source_stat']) != [stat.st_size, stat.st_mtime_ns]:
+                    raise ValueError(f'Checkpoint file {path} is outdated')
+
+            offsets = data['offsets'].tolist()
+            raw_offsets = data['raw_offsets'].tolist()
+            size = int(data['size'])
+
+        with self._lock:
+            if offsets[-1] > self._offsets[-1]:
+                self._offsets = offsets
+                self._raw_offsets = raw_offsets
+                self._states = [None] * len(offsets)
+                self._cursor = None
+            if size >= 0:
+                self.size = size
+
+    def close(self):
+        self._raw.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+class GzipReader(SeekableReader):
+    '''
+    Random access to gzip files.
+
+    A copy of the zlib decompressor state is kept every ``spacing`` bytes,
+    in addition to the start of each gzip member. These states are only kept
+    in memory and take about 40 kB each. At most ``max_states`` are kept,
+    about 10 MB by default: when there would be more, the spacing is doubled
+    and every other state is dropped. Random access into large single-member
+    files then decompresses up to ``spacing`` bytes, e.g. about 200 MB for 50 GB
+    of uncompressed data. Files with many members, e.g. written using
+    `compress_seekable`, do not need states.
+    '''
+
+    def _new_decompressor(self):
+        return zlib.decompressobj(wbits=31)
+
+    def _copy_state(self, cursor):
+        if cursor.decompressor.eof:
+            # either the end of the file or the start of the next member
+            return None
+        return cursor.raw_offset - len(cursor.pending), cursor.decompressor.copy()
+
+    def _step(self, cursor, max_length):
+        decompressor = cursor.decompressor
+
+        if decompressor.eof:
+            while len(cursor.pending) < len(GZIP_MAGIC) and self._read_raw(cursor):
+                pass
+            # end of file, ignoring trailing garbage like gzip does
+            if cursor.pending[:len(GZIP_MAGIC)] != GZIP_MAGIC:
+                return None
+
+            self._add_checkpoint(cursor.offset, cursor.raw_offset - len(cursor.pending))
+            cursor.decompressor = decompressor = self._new_decompressor()
+
+        if not cursor.pending and not self._read_raw(cursor):
+            return None
+
+        data = decompressor.decompress(cursor.pending, max_length)
+        if decompressor.eof:
+            cursor.pending = decompressor.unused_data
+        else:
+            cursor.pending = decompressor.unconsumed_tail
+        return data
+
+
+class ZstdReader(SeekableReader):
+    '''
+    Random access to zstd files.
+
+    Checkpoints are only possible at the start of frames, so files consisting
+    of a single frame are always decompressed from the start.
+    The frames are taken from the seek table of files in the zstd seekable format,
+    otherwise they are found while decompressing.
+
+    The frames are decompressed using the zstd backend, see `corsikaio.backends.get_decompressor`.
+    '''
+
+    def __init__(self, path, spacing=DEFAULT_SPACING):
+        # fail early if no installed backend supports random access
+        get_decompressor('zstd')
+        super().__init__(path, spacing=spacing)
+        self._read_seek_table()
+
+    def _new_decompressor(self):
+        return get_decompressor('zstd')
+
+    def _read_seek_table(self):
+        self._raw.seek(0, os.SEEK_END)
+        size = self._raw.tell()
+        if size < SKIPPABLE_HEADER.size + SEEK_TABLE_FOOTER.size:
+            return
+
+        self._raw.seek(size - SEEK_TABLE_FOOTER.size)
+        n_frames, descriptor, magic = SEEK_TABLE_FOOTER.unpack(self._raw.read(SEEK_TABLE_FOOTER.size))
+        if magic != SEEKABLE_MAGIC:
+            return
+
+        # entries contain a checksum if the highest bit of the descriptor is set
+        n_words = 3 if descriptor & 0x80 else 2
+        table_size = 4 * n_words * n_frames
+        table_start = size - SEEK_TABLE_FOOTER.size - table_size
+        if table_start < SKIPPABLE_HEADER.size:
+            return
+
+        self._raw.seek(table_start - SKIPPABLE_HEADER.size)
+        header = SKIPPABLE_HEADER.unpack(self._raw.read(SKIPPABLE_HEADER.size))
+        if header != (SKIPPABLE_MAGIC, table_size + SEEK_TABLE_FOOTER.size):
+            return
+
+        entries = np.frombuffer(self._raw.read(table_size), dtype='<u4').reshape(n_frames, n_words)
+        raw_offsets = np.zeros(n_frames + 1, dtype=np.int64)
+        offsets = np.zeros(n_frames + 1, dtype=np.int64)
+        np.cumsum(entries[:, 0], out=raw_offsets[1:])
+        np.cumsum(entries[:, 1], out=offsets[1:])
+
+        # for empty frames, reads start at the last checkpoint with the same position
+        self._offsets = offsets[:-1].tolist()
+        self._raw_offsets = raw_offsets[:-1].tolist()
+        self._states = [None] * n_frames
+        self.size = int(offsets[-1])
+
+    def _step(self, cursor, max_length):
+        if cursor.buffer_pos < len(cursor.buffer):
+            start = cursor.buffer_pos
+            cursor.buffer_pos = min(len(cursor.buffer), start + max_length)
+            return cursor.buffer[start:cursor.buffer_pos]
+
+        decompressor = cursor.decompressor
+        if decompressor.eof:
+            if not cursor.pending and not self._read_raw(cursor):
+                return None
+
+            self._add_checkpoint(cursor.offset, cursor.raw_offset - len(cursor.pending))
+            cursor.decompressor = decompressor = self._new_decompressor()
+
+        if not cursor.pending and not self._read_raw(cursor):
+            return None
+
+        cursor.buffer = decompressor.decompress(cursor.pending)
+        cursor.buffer_pos = 0
+        cursor.pending = decompressor.unused_data if decompressor.eof else b''
+        return b''
+
+
+class StreamReader(SeekableReader):
+    '''
+    Positional reads for other compression formats, see `corsikaio.backends`.
+
+    Without checkpoints, reading before the current position
+    decompresses again from the start of the file.
+    '''
+
+    def __init__(self, path, compression, spacing=DEFAULT_SPACING):
+        self.compression = compression
+        super().__init__(path, spacing=spacing)
+
+    def _new_decompressor(self):
+        self._raw.seek(0)
+        return open_decompressed(self._raw, self.compression)
+
+    def _step(self, cursor, max_length):
+        data = cursor.decompressor.read(max_length)
+        if not data:
+            return None
+        return data
+
+
+def open_seekable(path, compression, spacing=DEFAULT_SPACING):
+    '''Open a `GzipReader`, `ZstdReader` or `StreamReader` for ``path`` depending on ``compression``'''
+    if compression == 'gzip':
+        return GzipReader(path, spacing=spacing)
+    if compression == 'zstd':
+        return ZstdReader(path, spacing=spacing)
+    return StreamReader(path, compression, spacing=spacing)
+
+
+def compress_seekable(source, target, compression='zstd', frame_size=DEFAULT_SPACING, level=3):
+    '''
+    Compress the file ``source`` to ``target`` in independent frames.
+
+    For ``compression='zstd'``, the result is in the zstd seekable format, including
+    the seek table. For ``compression='gzip'``, every frame is a separate gzip member.
+    Both can be decompressed by the standard tools and allow fast random access
+    using `open_seekable`. ``source`` may itself be compressed.
+    '''
+    if compression == 'zstd':
+        def compress(data):
+            return _compress_zstd(data, level=level)
+    elif compression == 'gzip':
+        def compress(data):
+            return gzip.compress(data, compresslevel=level, mtime=0)
+    else:
+        raise ValueError(f'Unsupported compression {compression!r}')
+
+    entries = []
+    with open_compressed(source) as f, open(target, 'wb') as out:
+        while True:
+            data = read_exactly(f, frame_size)
+            if not data:
+                break
+
+            compressed = compress(data)
+            out.write(compressed)
+            entries.append((len(compressed), len(data)))
+
+        if compression == 'zstd':
+            table = np.array(entries, dtype='<u4').reshape(-1, 2).tobytes()
+            out.write(SKIPPABLE_HEADER.pack(SKIPPABLE_MAGIC, len(table) + SEEK_TABLE_FOOTER.size))
+            out.write(table)
+            out.write(SEEK_TABLE_FOOTER.pack(len(entries), 0, SEEKABLE_MAGIC))
@@ -72,26 +72,72 @@ def get_version(header_bytes, version_pos):
     return round(struct.unpack("f", header_bytes[sl])[0], 4)
 
 
-def parse_data_block(data_block_bytes, dtype):
+#: number of rows inspected at once when looking for the zero padding at the end of the data
+PADDING_CHUNK_ROWS = 64
+
+
+def count_filled_rows(values):
+    """Number of rows of the 2d array ``values`` up to the last row that is not all zeros.
+
+    Empty rows only occur as zero padding of the last sub-block of an event,
+    so only the end of the data is inspected instead of building a mask of all rows.
+    """
+    stop = len(values)
+    while stop > 0:
+        start = max(0, stop - PADDING_CHUNK_ROWS)
+        filled = np.flatnonzero(values[start:stop].any(axis=1))
+        if len(filled) > 0:
+            return start + int(filled[-1]) + 1
+        stop = start
+    return 0
+
+
+def trim_padding(data, values):
+    """Remove the zero padding at the end of ``data``, ``values`` is a float view of it.
+
+    Returns a view if ``data`` is writable, e.g. a buffer assembled by `CorsikaFile`,
+    otherwise a copy, so that the result is always writable.
+    """
+    data = data[:count_filled_rows(values)]
+    if not data.flags.writeable:
+        data = data.copy()
+    return data
+
+
+def parse_data_block(data_block_bytes, dtype, columns=None):
+    """Parse data blocks, removing empty rows at the end.
+
+    If ``columns`` is given, only these columns are returned as dict
+    of contiguous arrays instead of a structured array.
+    """
+    if columns is not None:
+        unknown = set(columns) - set(dtype.names)
+        if unknown:
+            raise ValueError(f"Unknown columns {sorted(unknown)}, available: {dtype.names}")
+
     data = np.frombuffer(data_block_bytes, dtype=dtype)
-    empty = data == np.zeros(1, dtype=dtype)
-    return data[~empty]
+    values = np.frombuffer(data_block_bytes, dtype=np.float32).reshape(len(data), dtype.itemsize // 4)
+    if columns is None:
+        return trim_padding(data, values)
+
+    n_rows = count_filled_rows(values)
+    return {name: np.ascontiguousarray(data[name][:n_rows]) for name in columns}
 
 
-def parse_cherenkov_photons(data_block_bytes):
-    return parse_data_block(data_block_bytes, dtype=cherenkov_photons_dtype)
+def parse_cherenkov_photons(data_block_bytes, columns=None):
+    return parse_data_block(data_block_bytes, dtype=cherenkov_photons_dtype, columns=columns)
 
 
-def parse_cherenkov_photons_thin(data_block_bytes):
-    return parse_data_block(data_block_bytes, dtype=cherenkov_photons_thin_dtype)
+def parse_cherenkov_photons_thin(data_block_bytes, columns=None):
+    return parse_data_block(data_block_bytes, dtype=cherenkov_photons_thin_dtype, columns=columns)
 
 
-def parse_particle_data(data_block_bytes):
-    return parse_data_block(data_block_bytes, dtype=particle_data_dtype)
+def parse_particle_data(data_block_bytes, columns=None):
+    return parse_data_block(data_block_bytes, dtype=particle_data_dtype, columns=columns)
 
 
-def parse_particle_data_thin(data_block_bytes):
-    return parse_data_block(data_block_bytes, dtype=particle_data_thin_dtype)
+def parse_particle_data_thin(data_block_bytes, columns=None):
+    return parse_data_block(data_block_bytes, dtype=particle_data_thin_dtype, columns=columns)
 
 
 def parse_longitudinal(longitudinal_data_bytes):
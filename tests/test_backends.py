@@ -0,0 +1,134 @@
+import bz2
+import gzip
+import lzma
+
+import pytest
+import numpy as np
+
+
+compressors = {
+    "gzip": gzip.compress,
+    "xz": lzma.compress,
+    "bz2": bz2.compress,
+}
+
+
+@pytest.mark.parametrize("compression", compressors.keys())
+def test_read_compressed(tmp_path, compression):
+    from corsikaio import CorsikaParticleFile
+    from corsikaio.io import open_mmap
+
+    source = "tests/resources/corsika757_particle"
+    with open(source, "rb") as f:
+        data = f.read()
+
+    path = tmp_path / "particles"
+    path.write_bytes(compressors[compression](data))
+
+    with CorsikaParticleFile(source) as f:
+        expected = list(f)
+
+    # compressed files must not be memory mapped as raw data
+    assert open_mmap(path) is None
+
+    with CorsikaParticleFile(path, mmap=True) as f:
+        assert f.layout.compression == compression
+        events = list(f)
+        assert f.run_end["n_events"] == 10
+
+        # random access
+        np.testing.assert_array_equal(f[7].particles, expected[7].particles)
+        np.testing.assert_array_equal(f[2].particles, expected[2].particles)
+
+    for event, expected_event in zip(events, expected):
+        np.testing.assert_array_equal(event.particles, expected_event.particles)
+
+
+def test_select_backend():
+    from corsikaio.backends import available_backends, get_backend, set_backend
+
+    assert available_backends("gzip")[-3:].count("gzip") == 1
+    assert get_backend("bz2").name == "bz2"
+
+    try:
+        set_backend("gzip", "gzip")
+        assert get_backend("gzip").name == "gzip"
+    finally:
+        set_backend("gzip", None)
+
+    with pytest.raises(ValueError):
+        set_backend("gzip", "does-not-exist")
+
+    with pytest.raises(ValueError):
+        get_backend("rar")
+
+
+def test_register_backend(tmp_path):
+    from corsikaio.backends import (
+        _backends, get_backend, open_decompressed, register_backend
+    )
+
+    opened = []
+
+    def open_bz2(source):
+        opened.append(source)
+        return bz2.open(source, "rb")
+
+    backends = list(_backends["bz2"])
+    try:
+        register_backend("bz2", "custom", open_bz2, first=True)
+        assert get_backend("bz2").name == "custom"
+
+        path = tmp_path / "data.bz2"
+        path.write_bytes(bz2.compress(b"hello"))
+        with open_decompressed(path, "bz2") as f:
+            assert f.read() == b"hello"
+        assert opened == [path]
+    finally:
+        _backends["bz2"][:] = backends
+
+
+def test_benchmark():
+    from corsikaio.backends import benchmark
+
+    results = benchmark(["tests/resources/corsika74100"], compressions=["gzip", "bz2"], repeat=1)
+    assert {r.compression for r in results} == {"gzip", "bz2"}
+    assert all(r.mb_per_s > 0 for r in results)
+
+
+def test_zstd_without_zstandard_backend(tmp_path, monkeypatch):
+    '''Only the registry is used for zstd, e.g. if only compression.zstd is installed'''
+    zstandard = pytest.importorskip("zstandard")
+    from corsikaio import CorsikaParticleFile, backends
+    from corsikaio.seekable import compress_seekable
+
+    source = "tests/resources/corsika757_particle"
+    path = tmp_path / "particles.zst"
+    compress_seekable(source, path, frame_size=20000)
+
+    used = []
+
+    def open_stream(source):
+        used.append("open")
+        return zstandard.ZstdDecompressor().stream_reader(source, closefd=False, read_across_frames=True)
+
+    def decompressor():
+        used.append("decompressor")
+        return zstandard.ZstdDecompressor().decompressobj()
+
+    monkeypatch.setitem(backends._backends, "zstd", [])
+    backends.register_backend("zstd", "fake", open_stream, decompressor=decompressor)
+
+    with CorsikaParticleFile(source) as f:
+        expected = f[7]
+
+    with CorsikaParticleFile(path) as f:
+        assert f.layout.compression == "zstd"
+        np.testing.assert_array_equal(f[7].particles, expected.particles)
+
+    assert "open" in used and "decompressor" in used
+
+    backends.register_backend("zstd", "fake", open_stream)
+    with pytest.raises(ValueError, match="random access"):
+        with CorsikaParticleFile(path) as f:
+            f[7]
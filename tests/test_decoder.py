@@ -0,0 +1,54 @@
+import pytest
+import numpy as np
+
+
+test_files = [
+    ("tests/resources/corsika757_particle", False),
+    ("tests/resources/corsika76900_thin", True),
+]
+
+
+@pytest.mark.parametrize("path,thinning", test_files)
+def test_decoder_matches_parse_functions(path, thinning):
+    from corsikaio import CorsikaParticleFile
+    from corsikaio.io import iter_blocks
+    from corsikaio.subblocks import (
+        parse_event_header,
+        parse_event_header_thin,
+        parse_particle_data,
+        parse_particle_data_thin,
+    )
+
+    with CorsikaParticleFile(path) as f:
+        decoder = f.decoder
+        assert decoder.thinning is thinning
+        assert decoder.version == f.version
+        assert decoder.block_size == f.block_size
+        assert decoder.row_width == (8 if thinning else 7)
+
+    with open(path, 'rb') as raw:
+        blocks = list(iter_blocks(raw, thinning=thinning))
+
+    header = next(block for block in blocks if block[:4] == b'EVTH')
+    data = b''.join(blocks[2:4])
+    if thinning:
+        assert decoder.event_header(header) == parse_event_header_thin(header)[0]
+        expected = parse_particle_data_thin(data)
+    else:
+        assert decoder.event_header(header) == parse_event_header(header)[0]
+        expected = parse_particle_data(data)
+
+    np.testing.assert_array_equal(decoder.payload(data), expected)
+
+
+def test_decoder_raw_payload():
+    from corsikaio.decoder import Decoder
+
+    decoder = Decoder(7.57)
+    assert decoder.payload_dtype is None
+    assert decoder.event_headers(b'').shape == (0, )
+
+    rows = np.zeros((39, 7), dtype=np.float32)
+    rows[:3] = 1.0
+    payload = decoder.payload(rows.tobytes())
+    assert payload.shape == (3, 7)
@@ -167,3 +167,490 @@ def test_longitudinal_parameters():
             parameters = event.end["longitudinal_fit_parameters"]
             np.testing.assert_array_equal(parameters != 0, True)
         assert n_events == 5
+
+
+@pytest.mark.parametrize("thinning,path", [
+    (False, "tests/resources/corsika757_particle"),
+    (True, "tests/resources/corsika76900_thin"),
+])
+def test_mmap(thinning, path):
+    from corsikaio import CorsikaParticleFile
+
+    with CorsikaParticleFile(path, thinning=thinning) as f:
+        assert f._mmap is not None
+        mapped = list(f)
+
+    with CorsikaParticleFile(path, thinning=thinning, mmap=False) as f:
+        assert f._mmap is None
+        read = list(f)
+
+    assert len(mapped) == len(read)
+    for event_mapped, event_read in zip(mapped, read):
+        assert event_mapped.header == event_read.header
+        np.testing.assert_array_equal(event_mapped.particles, event_read.particles)
+        np.testing.assert_array_equal(event_mapped.longitudinal, event_read.longitudinal)
+        assert event_mapped.end == event_read.end
+
+
+@pytest.mark.parametrize("mmap", (True, False))
+def test_read_event_headers(mmap):
+    from corsikaio import CorsikaParticleFile
+
+    with CorsikaParticleFile("tests/resources/corsika_77500_particle", mmap=mmap) as f:
+        events = list(f)
+        event_headers, event_ends = f.read_event_headers()
+
+        assert len(event_headers) == len(event_ends) == len(events) == 5
+        for event, header, end in zip(events, event_headers, event_ends):
+            assert event.header == header
+            assert event.end == end
+
+        # second call uses the index created by the first one
+        event_headers_again, event_ends_again = f.read_event_headers()
+        np.testing.assert_array_equal(event_headers, event_headers_again)
+        np.testing.assert_array_equal(event_ends, event_ends_again)
+        assert f.run_end["n_events"] == 5
+
+
+@pytest.mark.parametrize("mmap", (True, False))
+@pytest.mark.parametrize("with_index", (True, False))
+def test_iter_headers(mmap, with_index):
+    from corsikaio import CorsikaParticleFile
+
+    path = "tests/resources/corsika_77500_particle"
+    with CorsikaParticleFile(path) as f:
+        events = list(f)
+
+    with CorsikaParticleFile(path, mmap=mmap) as f:
+        if with_index:
+            f.create_index()
+
+        reads = []
+        read_range = f._read_range
+
+        def counting_read_range(start, stop):
+            reads.append(stop - start)
+            return read_range(start, stop)
+
+        f._read_range = counting_read_range
+
+        headers = list(f.iter_headers())
+        assert len(headers) == len(events)
+        # the payload is skipped using the index, only EVTH and EVTE are read
+        assert f._index is not None
+        assert reads == [f.block_size] * 2 * len(events)
+        for (header, end), event in zip(headers, events):
+            assert header == event.header
+            assert end == event.end
+
+        # normal iteration is not affected
+        assert next(f).header["event_number"] == 1
+
+
+def test_iter_headers_gzip(tmp_path):
+    import gzip
+    from corsikaio import CorsikaParticleFile
+
+    path = tmp_path / "particles.gz"
+    with open("tests/resources/corsika757_particle", "rb") as f, gzip.open(path, "wb") as out:
+        out.write(f.read())
+
+    with CorsikaParticleFile(path, parse_blocks=False) as f:
+        event_numbers = [header[1] for header, end in f.iter_headers()]
+        assert event_numbers == list(range(1, 11))
+
+
+@pytest.mark.parametrize("mmap", (True, False))
+def test_where(mmap):
+    from corsikaio import CorsikaParticleFile
+
+    path = "tests/resources/corsika757_particle"
+    with CorsikaParticleFile(path) as f:
+        events = list(f)
+
+    selected = [e for e in events if e.header["event_number"] % 2 == 0]
+    with CorsikaParticleFile(path, mmap=mmap, where=lambda h: h["event_number"] % 2 == 0) as f:
+        read = list(f)
+        assert [h["event_number"] for h, _ in f.iter_headers()] == [2, 4, 6, 8, 10]
+
+    assert len(read) == len(selected) == 5
+    for event, expected in zip(read, selected):
+        assert event.header == expected.header
+        np.testing.assert_array_equal(event.particles, expected.particles)
+
+    with CorsikaParticleFile(path, mmap=mmap, where={"event_number": (3, 6)}, parse_blocks=False) as f:
+        assert [e.header[1] for e in f] == [3, 4, 5]
+
+    with CorsikaParticleFile(path, where={"event_number": (None, 3)}) as f:
+        assert [e.header["event_number"] for e in f] == [1, 2]
+        # random access is not affected by the selection
+        assert f[5].header["event_number"] == 6
+
+
+def test_columns():
+    from corsikaio import CorsikaParticleFile, CorsikaCherenkovFile
+
+    path = "tests/resources/corsika757_particle"
+    with CorsikaParticleFile(path) as f:
+        events = list(f)
+
+    with CorsikaParticleFile(path, columns=("x", "y", "t")) as f:
+        for event, expected in zip(f, events):
+            assert list(event.particles.keys()) == ["x", "y", "t"]
+            for name, values in event.particles.items():
+                assert values.flags.c_contiguous
+                np.testing.assert_array_equal(values, expected.particles[name])
+
+    with CorsikaCherenkovFile("tests/resources/cer_corsika76900_thin", thinning=True, columns=("x", "thinning_weight")) as f:
+        event = next(f)
+        assert set(event.photons) == {"x", "thinning_weight"}
+
+    with pytest.raises(ValueError, match="Unknown columns"):
+        with CorsikaParticleFile(path, columns=("foo", )) as f:
+            next(f)
+
+    with pytest.raises(ValueError, match="parse_blocks"):
+        CorsikaParticleFile(path, columns=("x", ), parse_blocks=False)
+
+    with pytest.raises(ValueError, match="parse_blocks"):
+        CorsikaCherenkovFile("tests/resources/cer_corsika76900_thin", columns=("x", ), parse_blocks=False)
+
+    with CorsikaParticleFile(path, columns=("x", "y")) as f:
+        batch = next(f.iter_batches(max_events=3))
+
+    for i, expected in enumerate(events[:3]):
+        start, stop = batch.offsets[i], batch.offsets[i + 1]
+        particles = {name: column[start:stop] for name, column in batch.data.items()}
+        np.testing.assert_array_equal(particles["x"], expected.particles["x"])
+        np.testing.assert_array_equal(particles["y"], expected.particles["y"])
+
+
+@pytest.mark.parametrize("mmap", (True, False))
+@pytest.mark.parametrize("max_rows,max_bytes", [(100, None), (None, 5000), (1, 1)])
+def test_iter_chunked(mmap, max_rows, max_bytes):
+    from corsikaio import CorsikaParticleFile
+
+    path = "tests/resources/corsika757_particle"
+    with CorsikaParticleFile(path) as f:
+        events = list(f)
+
+    with CorsikaParticleFile(path, mmap=mmap) as f:
+        n_events = 0
+        for (header, chunks, end), expected in zip(f.iter_chunked(max_rows=max_rows, max_bytes=max_bytes), events):
+            n_events += 1
+            assert header == expected.header
+            assert end == expected.end
+
+            chunks = list(chunks)
+            for chunk in chunks:
+                if max_rows is not None:
+                    assert len(chunk) <= max(max_rows, 39)
+
+            particles = np.concatenate(chunks) if chunks else expected.particles[:0]
+            np.testing.assert_array_equal(particles, expected.particles)
+
+    assert n_events == len(events)
+
+    with pytest.raises(ValueError):
+        next(CorsikaParticleFile(path).iter_chunked())
+
+
+@pytest.mark.parametrize("parse_blocks", (True, False))
+@pytest.mark.parametrize("max_events,max_rows", [(3, None), (None, 500), (2, 100000)])
+def test_iter_batches(parse_blocks, max_events, max_rows):
+    from corsikaio import CorsikaParticleFile
+
+    path = "tests/resources/corsika757_particle"
+    with CorsikaParticleFile(path, parse_blocks=parse_blocks) as f:
+        events = list(f)
+
+    with CorsikaParticleFile(path, parse_blocks=parse_blocks) as f:
+        batches = list(f.iter_batches(max_events=max_events, max_rows=max_rows))
+
+    assert sum(len(batch.headers) for batch in batches) == len(events)
+
+    i = 0
+    for batch in batches:
+        assert len(batch.offsets) == len(batch.headers) + 1 == len(batch.ends) + 1
+        if max_events is not None:
+            assert len(batch.headers) <= max_events
+        if max_rows is not None and len(batch.headers) > 1:
+            assert len(batch.data) <= max_rows
+
+        for header, end, start, stop in zip(batch.headers, batch.ends, batch.offsets[:-1], batch.offsets[1:]):
+            event = events[i]
+            np.testing.assert_array_equal(header, event.header)
+            np.testing.assert_array_equal(end, event.end)
+            np.testing.assert_array_equal(batch.data[start:stop], event.particles)
+            i += 1
+
+
+def test_prefetch_truncated(tmp_path):
+    from corsikaio import CorsikaParticleFile
+    path = tmp_path / "truncated.dat"
+
+    with open("tests/resources/corsika757_particle", "rb") as f:
+        with path.open("wb") as out:
+            out.write(f.read(RECORD_MARKER.size + 2 * 22932))
+
+    with pytest.raises(IOError, match="seems to be truncated"):
+        with CorsikaParticleFile(path, prefetch=3, mmap=False) as f:
+            for _ in f:
+                pass
+
+
+@pytest.mark.parametrize("mmap", (True, False))
+def test_threads(mmap):
+    from concurrent.futures import ThreadPoolExecutor
+    from corsikaio import CorsikaParticleFile
+
+    path = "tests/resources/corsika757_particle"
+    with CorsikaParticleFile(path) as f:
+        expected = list(f)
+
+    with CorsikaParticleFile(path, mmap=mmap) as f:
+        if not mmap:
+            assert f._fd is not None
+
+        def read(i):
+            event = f[i % len(expected)]
+            assert f.run_end["n_events"] == 10
+            _, headers, _ = f.read_headers()
+            assert len(headers) == 10
+            return event
+
+        with ThreadPoolExecutor(8) as pool:
+            events = list(pool.map(read, range(50)))
+
+        # iteration is not affected by the reads in the threads
+        assert sum(1 for _ in f) == 10
+
+    for i, event in enumerate(events):
+        expected_event = expected[i % len(expected)]
+        assert event.header == expected_event.header
+        np.testing.assert_array_equal(event.particles, expected_event.particles)
+
+
+class NonSeekable:
+    '''Minimal file-like object without seek, like a pipe'''
+    def __init__(self, data):
+        self.data = data
+        self.pos = 0
+
+    def read(self, size=-1):
+        # return short reads like pipes do
+        size = min(size if size >= 0 else len(self.data), 1000)
+        chunk = self.data[self.pos:self.pos + size]
+        self.pos += len(chunk)
+        return chunk
+
+
+@pytest.mark.parametrize("compression", [None, "gzip", "zstd"])
+def test_stream(compression):
+    import gzip
+    import io
+    from corsikaio import CorsikaParticleFile
+
+    path = "tests/resources/corsika757_particle"
+    with open(path, "rb") as f:
+        data = f.read()
+
+    if compression == "gzip":
+        data = gzip.compress(data)
+    elif compression == "zstd":
+        zstd = pytest.importorskip("zstandard")
+        data = zstd.ZstdCompressor().compress(data)
+
+    with CorsikaParticleFile(path) as f:
+        expected = list(f)
+
+    stream = NonSeekable(data)
+    with CorsikaParticleFile(stream) as f:
+        with pytest.raises(io.UnsupportedOperation):
+            f.run_end
+
+        with pytest.raises(io.UnsupportedOperation):
+            f[0]
+
+        events = list(f)
+        assert f.run_end["n_events"] == 10
+
+    assert len(events) == len(expected)
+    for event, expected_event in zip(events, expected):
+        assert event.header["event_number"] == expected_event.header["event_number"]
+        np.testing.assert_array_equal(event.particles, expected_event.particles)
+
+    with CorsikaParticleFile(NonSeekable(data)) as f:
+        chunked = list(f.iter_chunked(max_rows=100))
+
+    assert len(chunked) == len(expected)
+    for (header, chunks, end), expected_event in zip(chunked, expected):
+        assert header == expected_event.header
+        assert end == expected_event.end
+        chunks = list(chunks)
+        assert all(len(chunk) <= 100 for chunk in chunks)
+        particles = np.concatenate(chunks) if chunks else expected_event.particles[:0]
+        np.testing.assert_array_equal(particles, expected_event.particles)
+
+    # events already queued by the prefetch thread must not be lost
+    with CorsikaParticleFile(NonSeekable(data), prefetch=3) as f:
+        assert next(f).header == expected[0].header
+        headers = [header for header, _, _ in f.iter_chunked(max_rows=100)]
+
+    assert headers == [event.header for event in expected[1:]]
+
+
+def test_named_pipe(tmp_path):
+    import os
+    import threading
+    from corsikaio import CorsikaParticleFile
+
+    fifo = tmp_path / "corsika.fifo"
+    os.mkfifo(fifo)
+
+    def write():
+        with open("tests/resources/corsika757_particle", "rb") as f, open(fifo, "wb") as out:
+            out.write(f.read())
+
+    writer = threading.Thread(target=write)
+    writer.start()
+    try:
+        with CorsikaParticleFile(fifo) as f:
+            n_events = sum(1 for _ in f)
+            assert f.run_end["n_events"] == n_events == 10
+    finally:
+        writer.join()
+
+
+@pytest.mark.parametrize("path,thinning", [
+    ("tests/resources/corsika74100", False),
+    ("tests/resources/corsika75700", False),
+    ("tests/resources/corsika75700.zst", False),
+    ("tests/resources/corsika76900_thin", True),
+    ("tests/resources/cer_corsika76900_thin", True),
+])
+def test_detect_thinning(path, thinning):
+    from corsikaio import CorsikaFile
+
+    with CorsikaFile(path) as f:
+        assert f.thinning is thinning
+        assert f.layout.thinning is thinning
+        assert f.layout.buffer_size is not None
+        n_events = sum(1 for _ in f)
+
+    with CorsikaFile(path, thinning=thinning) as f:
+        assert n_events == sum(1 for _ in f)
+
+
+@pytest.mark.parametrize("mmap", (True, False))
+def test_payload_writable(mmap):
+    from corsikaio import CorsikaParticleFile
+
+    with CorsikaParticleFile("tests/resources/corsika757_particle", mmap=mmap) as f:
+        for event in f:
+            assert event.particles.flags.writeable
+            assert len(event.particles) == 0 or np.any(event.particles[-1].tolist())
+            event.particles["x"] += 1
+
+
+def test_count_filled_rows():
+    from corsikaio.subblocks import count_filled_rows, parse_particle_data
+
+    values = np.zeros((200, 7), dtype=np.float32)
+    assert count_filled_rows(values) == 0
+
+    values[3] = 1
+    assert count_filled_rows(values) == 4
+    values[150, 2] = -1
+    assert count_filled_rows(values) == 151
+
+    # only the padding at the end is removed, the result is a writable copy
+    particles = parse_particle_data(values.tobytes())
+    assert len(particles) == 151
+    assert particles.flags.writeable
+
+
+@pytest.mark.parametrize("parse_blocks", (True, False))
+def test_reuse_buffers(parse_blocks):
+    from corsikaio import CorsikaParticleFile
+
+    path = "tests/resources/corsika757_particle"
+    with CorsikaParticleFile(path, parse_blocks=parse_blocks) as f:
+        expected = list(f)
+
+    with CorsikaParticleFile(path, parse_blocks=parse_blocks, reuse_buffers=True) as f:
+        buffers = []
+        for event, expected_event in zip(f, expected):
+            np.testing.assert_array_equal(event.particles, expected_event.particles)
+            np.testing.assert_array_equal(event.longitudinal, expected_event.longitudinal)
+
+            buffer = f._buffers["data"]
+            assert np.shares_memory(event.particles, buffer)
+            if not buffers or buffers[-1] is not buffer:
+                # new buffers are only allocated if the event does not fit
+                assert not buffers or len(buffer) > len(buffers[-1])
+                buffers.append(buffer)
+
+        assert len(buffers) < len(expected)
+
+
+def test_read_next_into():
+    from corsikaio import CorsikaParticleFile
+
+    path = "tests/resources/corsika757_particle"
+    with CorsikaParticleFile(path) as f:
+        expected = list(f)
+
+    buffer = np.empty(10 * 1024**2, dtype=np.uint8)
+    small = bytearray(10)
+    with CorsikaParticleFile(path) as f:
+        event = f.read_next_into(buffer)
+        np.testing.assert_array_equal(event.particles, expected[0].particles)
+        assert np.shares_memory(event.particles, buffer)
+
+        # too small, a new array is used
+        event = f.read_next_into(small)
+        np.testing.assert_array_equal(event.particles, expected[1].particles)
+        assert not np.shares_memory(event.particles, np.frombuffer(small, dtype=np.uint8))
+
+        with pytest.raises(ValueError):
+            f.read_next_into(bytes(100))
+
+        n_events = 2
+        while True:
+            try:
+                f.read_next_into(buffer)
+                n_events += 1
+            except StopIteration:
+                break
+        assert n_events == 10
+
+
+@pytest.mark.parametrize("compression", [None, "gzip"])
+def test_read_longitudinal(tmp_path, compression):
+    import gzip
+    from corsikaio import CorsikaCherenkovFile
+
+    path = "tests/resources/corsika757_particle"
+    if compression == "gzip":
+        compressed = tmp_path / "particles.gz"
+        with open(path, "rb") as f:
+            compressed.write_bytes(gzip.compress(f.read()))
+        path = compressed
+
+    with CorsikaCherenkovFile(path) as f:
+        longitudinal = f.read_longitudinal()
+        events = list(f)
+
+    assert longitudinal.shape == (10, 40)
+    np.testing.assert_array_equal(longitudinal['vertical_depth'], np.tile(np.arange(20, 801, 20), (10, 1)))
+    for event, expected in zip(events, longitudinal):
+        np.testing.assert_array_equal(expected, event.longitudinal)
+
+
+def test_read_longitudinal_missing():
+    from corsikaio import CorsikaParticleFile
+
+    with CorsikaParticleFile("tests/resources/corsika_77500_particle") as f:
+        longitudinal = f.read_longitudinal()
+    assert longitudinal.shape == (5, 0)
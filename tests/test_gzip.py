@@ -20,3 +20,48 @@ def test_is_gzip(tmp_path):
         f.write(b'Hello World')
 
     assert is_gzip(path)
+
+
+def test_prefetch(tmp_path):
+    import numpy as np
+    from corsikaio import CorsikaParticleFile
+
+    path = tmp_path / "particles.gz"
+    with open("tests/resources/corsika757_particle", "rb") as f, gzip.open(path, "wb") as out:
+        out.write(f.read())
+
+    with CorsikaParticleFile(path) as f:
+        expected = list(f)
+
+    with CorsikaParticleFile(path, prefetch=2) as f:
+        events = list(f)
+        assert f.run_end["n_events"] == 10
+
+    assert len(events) == len(expected)
+    for event, expected_event in zip(events, expected):
+        assert event.header == expected_event.header
+        np.testing.assert_array_equal(event.particles, expected_event.particles)
+
+    # closing with a running prefetch thread
+    with CorsikaParticleFile(path, prefetch=1) as f:
+        next(f)
+        assert f.run_end["n_events"] == 10
+    assert not f._prefetch_thread.is_alive()
+
+
+def test_run_end(tmp_path):
+    from corsikaio import CorsikaParticleFile
+    from corsikaio.file import _scan_run_end
+
+    path = tmp_path / "particles.gz"
+    with open("tests/resources/corsika757_particle", "rb") as f, gzip.open(path, "wb") as out:
+        out.write(f.read())
+
+    _scan_run_end.cache_clear()
+    with CorsikaParticleFile(path) as f:
+        assert f.run_end["n_events"] == 10
+
+    # second file object for the same path uses the cached result
+    with CorsikaParticleFile(path) as f:
+        assert f.run_end["n_events"] == 10
+    assert _scan_run_end.cache_info().hits == 1
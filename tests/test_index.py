@@ -0,0 +1,107 @@
+import shutil
+
+import pytest
+import numpy as np
+
+
+test_files = [
+    ("tests/resources/corsika757_particle", False, 10),
+    ("tests/resources/corsika_77500_particle", False, 5),
+    ("tests/resources/corsika76900_thin", True, 5),
+]
+
+
+@pytest.mark.parametrize("path,thinning,n_events", test_files)
+@pytest.mark.parametrize("mmap", (True, False))
+def test_random_access(path, thinning, n_events, mmap):
+    from corsikaio import CorsikaParticleFile
+
+    with CorsikaParticleFile(path, thinning=thinning) as f:
+        events = list(f)
+
+    with CorsikaParticleFile(path, thinning=thinning, mmap=mmap) as f:
+        assert len(f) == n_events == len(events)
+
+        for i in (n_events - 1, 0, 2, -1):
+            event = f[i]
+            expected = events[i]
+            assert event.header == expected.header
+            assert event.end == expected.end
+            np.testing.assert_array_equal(event.particles, expected.particles)
+            np.testing.assert_array_equal(event.longitudinal, expected.longitudinal)
+
+        assert [e.header["event_number"] for e in f[1:4]] == [2, 3, 4]
+
+        event = f.get_event(event_number=3)
+        assert event.header["event_number"] == 3
+
+        with pytest.raises(IndexError):
+            f[n_events]
+
+        with pytest.raises(KeyError):
+            f.get_event(event_number=1000)
+
+        # random access does not change the iteration
+        assert sum(1 for _ in f) == n_events
+
+
+def test_index_gzip(tmp_path):
+    import gzip
+    from corsikaio import CorsikaParticleFile
+
+    path = tmp_path / "particles.gz"
+    with open("tests/resources/corsika757_particle", "rb") as f, gzip.open(path, "wb") as out:
+        out.write(f.read())
+
+    with CorsikaParticleFile(path) as f:
+        assert len(f) == 10
+        assert f[7].header["event_number"] == 8
+        assert f.index.run_end > 0
+
+
+def test_index_offsets():
+    from corsikaio import CorsikaFile
+
+    with CorsikaFile("tests/resources/corsika757_particle") as f:
+        index = f.index
+        data = open("tests/resources/corsika757_particle", "rb").read()
+
+        assert all(data[o:o + 4] == b"EVTH" for o in index.event_header)
+        assert all(data[o:o + 4] == b"EVTE" for o in index.event_end)
+        assert all(data[o:o + 4] == b"LONG" for o in index.longitudinal)
+        assert data[index.run_end:index.run_end + 4] == b"RUNE"
+        np.testing.assert_array_equal(index.event_number, np.arange(1, 11))
+
+        # fortran record markers are not part of any block
+        blocks = index.event_blocks(len(index) - 1)
+        assert np.all(np.diff(blocks) >= f.block_size)
+
+
+def test_save_index(tmp_path):
+    from corsikaio import CorsikaFile
+    from corsikaio.index import index_path, EventIndex
+
+    path = tmp_path / "particles.dat"
+    shutil.copy("tests/resources/corsika757_particle", path)
+
+    with CorsikaFile(path, save_index=True) as f:
+        assert len(f) == 10
+        index = f.index
+
+    assert index_path(path).is_file()
+    loaded = EventIndex.load(index_path(path), source=path)
+    np.testing.assert_array_equal(loaded.event_header, index.event_header)
+    np.testing.assert_array_equal(loaded.record_offsets, index.record_offsets)
+    assert loaded.run_end == index.run_end
+
+    with CorsikaFile(path) as f:
+        assert f._index is None
+        assert len(f) == 10
+        np.testing.assert_array_equal(f.index.event_end, index.event_end)
+
+    # outdated index files are not used
+    with path.open("ab") as f:
+        f.write(b"\0" * 8)
+
+    with pytest.raises(ValueError, match="outdated"):
+        EventIndex.load(index_path(path), source=path)
@@ -2,7 +2,7 @@ import pytest
 import numpy as np
 from scipy.io import FortranFile
 
-from corsikaio.io import iter_blocks
+from corsikaio.io import RECORD_MARKER, iter_blocks
 
 
 test_files = (
@@ -169,3 +169,76 @@ def test_iter_blocks_truncated(size, tmp_path, dummy_file):
         with path.open("rb") as f:
             for _ in iter_blocks(f):
                 pass
+
+
+def test_iter_blocks_mmap(dummy_file):
+    from corsikaio.io import iter_blocks_mmap, open_mmap
+
+    buffer = open_mmap(dummy_file)
+    with dummy_file.open('rb') as f:
+        blocks = list(iter_blocks(f))
+
+    views = list(iter_blocks_mmap(buffer))
+    assert len(views) == len(blocks) == 27
+    assert all(isinstance(view, memoryview) for view in views)
+    assert all(view == block for view, block in zip(views, blocks))
+
+
+@pytest.mark.parametrize("size", (100, 1000, 5000))
+def test_iter_blocks_mmap_truncated(size, tmp_path, dummy_file):
+    from corsikaio.io import iter_blocks_mmap, open_mmap
+
+    path = tmp_path / f"test_truncated_{size}.dat"
+
+    with path.open("wb") as out, dummy_file.open("rb") as infile:
+        out.write(infile.read(size))
+
+    with pytest.raises(IOError, match="file seems to be truncated"):
+        for _ in iter_blocks_mmap(open_mmap(path)):
+            pass
+
+
+@pytest.mark.parametrize("mmap", (True, False))
+def test_run_end_dummy_file(dummy_file, mmap):
+    from corsikaio import CorsikaFile
+
+    with CorsikaFile(dummy_file, mmap=mmap) as f:
+        assert f.run_end["RUNE"] == b"RUNE"
+        assert f.run_end["run_number"] == 1.0
+
+
+@pytest.mark.parametrize("compression", [None, "gzip", "zstd"])
+@pytest.mark.parametrize("fortran", [True, False])
+def test_probe(tmp_path, compression, fortran):
+    import gzip
+    import io
+    from corsikaio.io import probe, probe_stream
+
+    with open("tests/resources/corsika76900_thin", "rb") as f:
+        data = f.read()
+
+    if not fortran:
+        # strip the record markers of the first record
+        size, = RECORD_MARKER.unpack(data[:4])
+        data = data[4:4 + size]
+
+    if compression == "gzip":
+        data = gzip.compress(data)
+    elif compression == "zstd":
+        zstd = pytest.importorskip("zstandard")
+        data = zstd.ZstdCompressor().compress(data)
+
+    path = tmp_path / "corsika"
+    path.write_bytes(data)
+
+    with open(path, "rb") as f:
+        layout = probe(f)
+        assert f.tell() == 0
+
+    assert layout.compression == compression
+    assert layout.thinning is True
+    assert layout.buffer_size == (26208 if fortran else None)
+
+    stream, stream_layout = probe_stream(io.BytesIO(data))
+    assert stream_layout == layout
+    assert stream.read(4) == (RECORD_MARKER.pack(26208) if fortran else b"RUNH")
@@ -50,3 +50,112 @@ def test_invalid(tmp_path):
 
     with pytest.raises(IOError, match="does not seem to be"):
         next(read_longitudinal_distributions("tests/resources/corsika_77500_particle"))
+
+
+def test_longitudinal_file():
+    from corsikaio.longitudinal import LongitudinalFile, read_longitudinal_distributions
+
+    path = "tests/resources/corsika_77500_particle_slant.long"
+    showers = list(read_longitudinal_distributions(path))
+
+    with LongitudinalFile(path) as f:
+        assert len(f) == 5
+        np.testing.assert_array_equal(f.shower, [1, 2, 3, 4, 5])
+
+        shower = f.read_shower(3)
+        np.testing.assert_array_equal(shower["particles"], showers[2]["particles"])
+
+        stacked = f.read_all()
+
+    assert stacked.particles.shape == (5, 105)
+    assert stacked.energy_deposition.shape == (5, 105)
+    for i, longi in enumerate(showers):
+        np.testing.assert_array_equal(stacked.particles[i], longi["particles"])
+        np.testing.assert_array_equal(stacked.energy_deposition[i], longi["energy_deposition"])
+        np.testing.assert_array_equal(stacked.fit["parameters"][i], longi["parameters"])
+        assert stacked.fit["chi2_ndf"][i] == longi["chi2_ndf"]
+
+    with LongitudinalFile(path) as f, pytest.raises(KeyError):
+        f.read_shower(6)
+
+
+def test_longitudinal_file_padding(tmp_path):
+    from corsikaio.longitudinal import LongitudinalFile
+
+    vertical = open("tests/resources/corsika_77500_particle_vertical.long", "rb").read()
+    slant = open("tests/resources/corsika_77500_particle_slant.long", "rb").read()
+    path = tmp_path / "mixed.long"
+    path.write_bytes(vertical + slant)
+
+    with LongitudinalFile(path) as f:
+        stacked = f.read_all()
+
+    np.testing.assert_array_equal(stacked.n_steps, [208] + 5 * [105])
+    assert stacked.particles.shape == (6, 208)
+    assert np.isnan(stacked.particles["charged"][1:, 105:]).all()
+    assert not np.isnan(stacked.particles["charged"][:, :105]).any()
+
+
+def test_evaluate_longitudinal_fit():
+    from corsikaio import evaluate_longitudinal_fit, longitudinal_fit_function
+
+    parameters = np.array([
+        [9.1727E+03, -1.5261E+02, 4.7857E+02, 2.3037E+01, 4.4026E-02, -2.9071E-05],
+        [1.0063E+04, 1.1996E+02, 5.9544E+02, 4.0720E+01, 3.0459E-05, 1.6663E-07],
+    ])
+    depth = np.linspace(200, 1000, 50)
+
+    values = evaluate_longitudinal_fit(depth, parameters)
+    assert values.shape == (2, 50)
+    for row, p in zip(values, parameters):
+        np.testing.assert_allclose(row, longitudinal_fit_function(depth, *p))
+
+    per_profile = evaluate_longitudinal_fit(np.stack([depth, depth + 10]), parameters)
+    np.testing.assert_allclose(per_profile[1], longitudinal_fit_function(depth + 10, *parameters[1]))
+
+
+def test_fit_longitudinal():
+    from corsikaio import LongitudinalFile, fit_longitudinal
+
+    with LongitudinalFile("tests/resources/corsika_77500_particle_slant.long") as f:
+        showers = f.read_all()
+
+    parameters, chi2_ndf = fit_longitudinal(showers.particles["depth"], showers.particles["charged"])
+    assert parameters.shape == (5, 6)
+
+    # compare to the fit done by CORSIKA
+    expected = showers.fit["parameters"]
+    np.testing.assert_allclose(parameters[:, 0], expected[:, 0], rtol=0.01)
+    np.testing.assert_allclose(parameters[:, 2], expected[:, 2], atol=2)
+    np.testing.assert_allclose(chi2_ndf, showers.fit["chi2_ndf"], rtol=0.2)
+
+    # NaN padding and profiles without particles
+    depth = np.full((2, 120), np.nan)
+    depth[0, :105] = showers.particles["depth"][0]
+    depth[1] = np.arange(120)
+    counts = np.full((2, 120), np.nan)
+    counts[0, :105] = showers.particles["charged"][0]
+    counts[1] = 0
+    padded, padded_chi2_ndf = fit_longitudinal(depth, counts)
+    np.testing.assert_allclose(padded[0], parameters[0])
+    assert np.isnan(padded[1]).all()
+    assert np.isnan(padded_chi2_ndf[1])
+
+
+def test_fit_longitudinal_noisy():
+    import warnings
+    from corsikaio import LongitudinalFile, fit_longitudinal
+
+    with LongitudinalFile("tests/resources/corsika_77500_particle_slant.long") as f:
+        showers = f.read_all()
+
+    rng = np.random.default_rng(1)
+    counts = rng.poisson(np.repeat(showers.particles["charged"], 20, axis=0)).astype(float)
+
+    with warnings.catch_warnings():
+        warnings.simplefilter("error", RuntimeWarning)
+        parameters, chi2_ndf = fit_longitudinal(showers.particles["depth"][0], counts)
+
+    assert np.isfinite(chi2_ndf).all()
+    expected = np.repeat(showers.fit["parameters"][:, 2], 20)
+    np.testing.assert_allclose(parameters[:, 2], expected, atol=20)
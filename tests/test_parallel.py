@@ -0,0 +1,129 @@
+import pytest
+import numpy as np
+
+
+paths = [
+    "tests/resources/corsika757_particle",
+    "tests/resources/corsika_77500_particle",
+    "tests/resources/corsika75700",
+]
+
+
+def n_events(f):
+    return sum(1 for _ in f)
+
+
+def particle_positions(event):
+    return {"x": event.particles["x"], "y": event.particles["y"]}
+
+
+@pytest.mark.parametrize("ordered", (True, False))
+def test_map_files(ordered):
+    from corsikaio.parallel import map_files
+
+    results = dict(map_files(paths, n_events, workers=2, ordered=ordered))
+    assert results == {paths[0]: 10, paths[1]: 5, paths[2]: 10}
+
+    if ordered:
+        assert [path for path, _ in map_files(paths, n_events, workers=2)] == paths
+
+
+@pytest.mark.parametrize("shared_memory", (True, False))
+def test_map_events(shared_memory):
+    from corsikaio import CorsikaParticleFile
+    from corsikaio.parallel import map_events
+
+    path = paths[0]
+    with CorsikaParticleFile(path) as f:
+        expected = [particle_positions(e) for e in f]
+
+    results = list(map_events(
+        [path], particle_positions,
+        workers=1, file_class=CorsikaParticleFile, shared_memory=shared_memory,
+    ))
+
+    assert len(results) == 1
+    result_path, events = results[0]
+    assert result_path == path
+    assert len(events) == len(expected)
+    for event, expected_event in zip(events, expected):
+        np.testing.assert_array_equal(event["x"], expected_event["x"])
+        np.testing.assert_array_equal(event["y"], expected_event["y"])
+
+
+def identity(event):
+    return event
+
+
+@pytest.mark.parametrize("shared_memory", (True, False))
+def test_map_events_auxiliary(shared_memory):
+    from corsikaio import CorsikaParticleFile
+    from corsikaio.parallel import map_events
+
+    path = "tests/resources/corsika76900_thin"
+    with CorsikaParticleFile(path, auxiliary=True) as f:
+        expected = list(f)
+
+    [(_, events)] = map_events(
+        [path], identity,
+        workers=1, file_class=CorsikaParticleFile, shared_memory=shared_memory, auxiliary=True,
+    )
+
+    assert len(events) == len(expected)
+    for event, expected_event in zip(events, expected):
+        np.testing.assert_array_equal(event.particles, expected_event.particles)
+        np.testing.assert_array_equal(event.auxiliary.records, expected_event.auxiliary.records)
+        np.testing.assert_array_equal(event.auxiliary.particle, expected_event.auxiliary.particle)
+
+
+def test_dataset():
+    from corsikaio import CorsikaDataset, CorsikaParticleFile
+
+    dataset = CorsikaDataset("tests/resources/corsika*_particle", file_class=CorsikaParticleFile, workers=2)
+    assert len(dataset) == 2
+    assert sorted(n for _, n in dataset.map_files(n_events, ordered=False)) == [5, 10]
+
+
+def total_energy(event):
+    return event.header["total_energy"], len(event.particles)
+
+
+@pytest.mark.parametrize("shared_memory", (True, False))
+def test_read_parallel(shared_memory):
+    from corsikaio import CorsikaParticleFile
+
+    path = "tests/resources/corsika757_particle"
+    with CorsikaParticleFile(path) as f:
+        expected = [total_energy(e) for e in f]
+
+    with CorsikaParticleFile(path) as f:
+        results = f.read_parallel(total_energy, workers=2, shared_memory=shared_memory)
+    assert results == expected
+
+    with CorsikaParticleFile(path, where=lambda h: h["event_number"] > 5) as f:
+        results = f.read_parallel(total_energy, workers=2)
+    assert results == expected[5:]
+
+
+def test_map_files_bounded(monkeypatch):
+    from concurrent.futures import ProcessPoolExecutor
+    from corsikaio import parallel
+
+    submitted = []
+
+    class CountingPool(ProcessPoolExecutor):
+        def submit(self, *args, **kwargs):
+            submitted.append(args[1])
+            return super().submit(*args, **kwargs)
+
+    monkeypatch.setattr(parallel, "ProcessPoolExecutor", CountingPool)
+
+    many = paths * 4
+    results = parallel.map_files(many, n_events, workers=1, shared_memory=True)
+    path, n = next(results)
+    assert path == many[0] and n == 10
+    # two files in flight per worker, plus the one submitted after the first result
+    assert len(submitted) == 3
+
+    assert [path for path, _ in results] == many[1:]
+    assert len(submitted) == len(many)
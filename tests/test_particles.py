@@ -0,0 +1,95 @@
+import numpy as np
+import pytest
+
+
+def test_decode_particle_description():
+    from corsikaio.particles import decode_particle_description
+
+    description = np.array([5011, 6990, 14001, 5626003, -75002], dtype=np.float32)
+    particle_id, generation, level = decode_particle_description(description)
+
+    np.testing.assert_array_equal(particle_id, [5, 6, 14, 5626, -75])
+    np.testing.assert_array_equal(generation, [1, 99, 0, 0, 0])
+    np.testing.assert_array_equal(level, [1, 10, 1, 3, 2])
+
+
+def test_split_by_level():
+    from corsikaio.particles import split_by_level
+
+    particles = np.arange(6) * 10
+    level = np.array([2, 1, 2, 3, 1, 2])
+    levels = split_by_level(particles, level, n_levels=4)
+
+    assert list(levels) == [1, 2, 3, 4]
+    np.testing.assert_array_equal(levels[1], [10, 40])
+    np.testing.assert_array_equal(levels[2], [0, 20, 50])
+    np.testing.assert_array_equal(levels[3], [30])
+    assert len(levels[4]) == 0
+
+    columns = split_by_level({'x': particles}, level)
+    np.testing.assert_array_equal(columns[2]['x'], [0, 20, 50])
+
+    with pytest.raises(ValueError):
+        split_by_level(particles, level, n_levels=2)
+
+    with pytest.raises(ValueError):
+        split_by_level(particles, level - 1)
+
+
+def test_particle_event():
+    from corsikaio import CorsikaParticleFile
+
+    with CorsikaParticleFile('tests/resources/corsika757_particle') as f:
+        event = next(f)
+
+    description = event.particles['particle_description']
+    np.testing.assert_array_equal(event.particle_id, description // 1000)
+    assert event.particle_id is event.particle_id
+
+    levels = event.by_level()
+    assert len(levels) == event.header['n_observation_levels']
+    assert sum(len(particles) for particles in levels.values()) == len(event.particles)
+
+    with CorsikaParticleFile('tests/resources/corsika757_particle', columns=('particle_description', 'x')) as f:
+        event = next(f)
+    np.testing.assert_array_equal(event.particle_id, description // 1000)
+
+
+def test_split_auxiliary():
+    from corsikaio.particles import split_auxiliary
+
+    description = np.array([75011, 5011, 1011, -6011, 86011, 6011, 76011], dtype=np.float32)
+    particles, auxiliary = split_auxiliary({'particle_description': description})
+
+    np.testing.assert_array_equal(particles['particle_description'], [5011, 1011, 6011])
+    np.testing.assert_array_equal(auxiliary.records['particle_description'], [75011, -6011, 86011, 76011])
+    np.testing.assert_array_equal(auxiliary.particle, [0, 2, 2, -1])
+
+
+def test_muaddi():
+    from corsikaio import CorsikaParticleFile
+    from corsikaio.particles import decode_particle_description
+
+    path = 'tests/resources/corsika76900_thin'
+    with CorsikaParticleFile(path) as f:
+        events = list(f)
+    n_rows = [len(event.particles) for event in events]
+
+    # the level digit of the MUADDI records is not an observation level
+    with pytest.raises(ValueError):
+        events[0].by_level()
+
+    with CorsikaParticleFile(path, auxiliary=True) as f:
+        for event, n in zip(f, n_rows):
+            records, particle = event.auxiliary
+            assert len(event.particles) + len(records) == n
+            assert not np.isin(event.particle_id, (75, 76)).any()
+
+            assert event._replace(end=None).auxiliary is event.auxiliary
+
+            levels = event.by_level()
+            assert sum(len(particles) for particles in levels.values()) == len(event.particles)
+
+            # muon additional information is followed by the muon
+            record_id, _, _ = decode_particle_description(records['particle_description'])
+            np.testing.assert_array_equal(event.particle_id[particle], record_id - 70)
@@ -0,0 +1,131 @@
+import gzip
+
+import pytest
+import numpy as np
+
+
+@pytest.fixture(scope="module")
+def data():
+    with open("tests/resources/corsika75700", "rb") as f:
+        return f.read() * 5
+
+
+def write_compressed(path, data, compression, seekable, frame_size=50000):
+    from corsikaio.seekable import compress_seekable
+
+    if seekable:
+        plain = path.with_name("plain")
+        plain.write_bytes(data)
+        compress_seekable(plain, path, compression=compression, frame_size=frame_size)
+    elif compression == "gzip":
+        path.write_bytes(gzip.compress(data))
+    else:
+        zstd = pytest.importorskip("zstandard")
+        path.write_bytes(zstd.ZstdCompressor().compress(data))
+
+
+@pytest.mark.parametrize("compression", ["gzip", "zstd"])
+@pytest.mark.parametrize("seekable", [True, False])
+def test_random_reads(tmp_path, data, compression, seekable):
+    from corsikaio.seekable import open_seekable
+
+    if compression == "zstd":
+        pytest.importorskip("zstandard")
+
+    path = tmp_path / "data"
+    write_compressed(path, data, compression, seekable)
+
+    rng = np.random.default_rng(0)
+    with open_seekable(path, compression, spacing=2**16) as reader:
+        if compression == "zstd" and seekable:
+            # from the seek table
+            assert reader.size == len(data)
+            assert len(reader) == len(range(0, len(data), 50000))
+
+        for start in rng.integers(0, len(data) + 100, 100):
+            stop = start + rng.integers(0, 30000)
+            assert reader.read(start, stop) == data[start:stop]
+
+        assert reader.stream().read() == data
+        assert reader.size == len(data)
+        if compression == "gzip" or seekable:
+            assert len(reader) > 1
+
+
+def test_save_load(tmp_path, data):
+    from corsikaio.seekable import GzipReader
+
+    path = tmp_path / "data.gz"
+    # members starting at the spacing boundaries, like compress_seekable by default
+    write_compressed(path, data, "gzip", seekable=True, frame_size=2**16)
+
+    with GzipReader(path, spacing=2**16) as reader:
+        reader.stream().read()
+        assert all(state is None for state in reader._states)
+        reader.save(tmp_path / "checkpoints.npz", source=path)
+        n_checkpoints = len(reader)
+
+    with GzipReader(path, spacing=2**16) as reader:
+        reader.load(tmp_path / "checkpoints.npz", source=path)
+        assert len(reader) == n_checkpoints == len(range(0, len(data), 2**16))
+        assert len(reader) > 1
+        start = 3 * 2**16 + 10
+        assert reader.read(start, start + 100) == data[start:start + 100]
+        assert reader.size == len(data)
+        assert reader.read(len(data) - 10, len(data)) == data[-10:]
+
+    # modified file
+    with open(path, "ab") as f:
+        f.write(gzip.compress(b"foo"))
+
+    with GzipReader(path) as reader, pytest.raises(ValueError):
+        reader.load(tmp_path / "checkpoints.npz", source=path)
+
+
+@pytest.mark.parametrize("compression", ["gzip", "zstd"])
+def test_corsika_file(tmp_path, compression):
+    from corsikaio import CorsikaParticleFile
+    from corsikaio.seekable import compress_seekable, seek_index_path
+
+    if compression == "zstd":
+        pytest.importorskip("zstandard")
+
+    source = "tests/resources/corsika757_particle"
+    path = tmp_path / "particles"
+    compress_seekable(source, path, compression=compression, frame_size=20000)
+
+    with CorsikaParticleFile(source) as f:
+        expected = list(f)
+
+    with CorsikaParticleFile(path, save_index=True) as f:
+        if compression == "zstd":
+            # the seek table allows to read the end directly
+            assert f.run_end["n_events"] == 10
+        for i in (7, 2, 9, 0):
+            np.testing.assert_array_equal(f[i].particles, expected[i].particles)
+        assert sum(1 for _ in f) == 10
+
+    assert seek_index_path(path).exists()
+
+    with CorsikaParticleFile(path) as f:
+        assert len(f._seekable_reader()) > 1
+        assert f.run_end["n_events"] == 10
+        np.testing.assert_array_equal(f[-1].particles, expected[-1].particles)
+
+
+def test_max_states(tmp_path, data):
+    from corsikaio.seekable import GzipReader
+
+    path = tmp_path / "data.gz"
+    write_compressed(path, data, "gzip", seekable=False)
+
+    with GzipReader(path, spacing=2**12, max_states=4) as reader:
+        assert reader.stream().read() == data
+        states = [state for state in reader._states if state is not None]
+        assert 0 < len(states) <= 4
+        assert reader.spacing > 2**12
+        assert all(offset % reader.spacing == 0 for offset in reader._offsets)
+
+        rng = np.random.default_rng(0)
+        for start in rng.integers(0, len(data), 50):
+            assert reader.read(start, start + 5000) == data[start:start + 5000]
@@ -22,3 +22,11 @@ def test_is_zstd(tmp_path):
             writer.write(b'Hello World')
 
     assert is_zstd(path)
+
+
+def test_run_end():
+    pytest.importorskip("zstandard")
+    from corsikaio import CorsikaCherenkovFile
+
+    with CorsikaCherenkovFile('tests/resources/corsika75700.zst') as f:
+        assert f.run_end['n_events'] == 10